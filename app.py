@@ -1,16 +1,31 @@
 import os
 os.environ["STREAMLIT_SERVER_ENABLE_FILE_WATCHER"] = "false"
 
-import torch
-torch.classes.__path__ = []
+import queue
+import sys
+import threading
+import uuid
 
 import streamlit as st
-import json
-from config.prompts import code_template, summary_template
-from core.model import load_model
-from core.executor import run_pipeline
-from langchain.chains import LLMChain
-from torch_geometric.datasets import OPFDataset
+# Only light modules here: torch, torch_geometric, transformers and
+# langchain are imported lazily (see core.startup) so a script run stays cheap
+from config.profiles import default_profile, load_profiles
+from config.startup import preload
+from core import client, registry, startup, transport
+from core.query_cache import shared_cache
+from core.result_cache import shared_result_cache
+from core.tracing import NULL_TRACE, Trace
+
+# When set, this app is a thin client of `python -m core.service`
+SERVICE_URL = os.environ.get("OPF_SERVICE_URL")
+
+if not SERVICE_URL:
+    # Overlap the heavy imports (and an optional preload) with the user
+    # picking options; both happen once per server process
+    startup.warm_imports()
+    boot_job = startup.preload_on_boot(preload, root='data')
+else:
+    boot_job = None
 
 st.set_page_config(page_title="Power Grid LLM Interface", layout="wide")
 st.title("🔌 Power Grid Code Assistant with LLM")
@@ -18,72 +33,534 @@ st.title("🔌 Power Grid Code Assistant with LLM")
 # Session setup
 if "model_loaded" not in st.session_state:
     st.session_state.model_loaded = False
+if "lease" not in st.session_state:
+    # Registry references of this session; released when Streamlit drops
+    # the session, even if it never loads anything else
+    st.session_state.lease = registry.Lease()
+
+
+def finish_loading(job, batch_requests):
+    """Move a finished :class:`core.startup.LoadJob` into this session."""
+    lease = st.session_state.lease
+    try:
+        (data_key, (dataset, grid)), (llm_key, llm) = job.result()
+    except Exception as e:
+        # Give back whichever half did load
+        if job.dataset.exception() is None:
+            lease.release(registry.datasets, job.dataset.result()[0])
+        if job.model.exception() is None:
+            lease.release(registry.models, job.model.result()[0])
+        st.session_state.load_error = str(e)
+        return
+
+    from langchain.chains import LLMChain
+    from config.prompts import code_template, summary_template
+    from core.sandbox import shared_pool
+    from core.scheduler import ScheduledChain, shared_scheduler
+
+    # The job took fresh references; drop the ones this session held
+    if st.session_state.get("data_key") is not None:
+        lease.release(registry.datasets, st.session_state.data_key)
+    if st.session_state.get("llm_key") is not None:
+        lease.release(registry.models, st.session_state.llm_key)
+    st.session_state.data_key = data_key
+    st.session_state.data = dataset
+    st.session_state.grid = grid
+    st.session_state.llm_key = llm_key
+    st.session_state.llm = llm
+    shared_pool(data_key, root='data')  # workers warm up while the user types a query
+
+    code_chain = LLMChain(llm=llm, prompt=code_template)
+    summary_chain = LLMChain(llm=llm, prompt=summary_template)
+    if batch_requests:
+        scheduler = shared_scheduler(llm_key, llm)
+        code_chain = ScheduledChain(code_chain, scheduler)
+        summary_chain = ScheduledChain(summary_chain, scheduler)
+    st.session_state.code_chain = code_chain
+    st.session_state.summary_chain = summary_chain
+    st.session_state.load_timings = {
+        "imports": startup.timings.get("imports"),
+        **{name: stage["seconds"] for name, stage in job.progress().items() if name != "imports"},
+    }
+    st.session_state.load_error = None
+    st.session_state.model_loaded = True
+
+
+STAGE_ICONS = {"pending": "⏳", "running": "🔄", "done": "✅", "error": "❌"}
+
+
+@st.fragment(run_every=1.0)
+def load_progress():
+    # Polls the background job without rerunning the whole script
+    job = st.session_state.get("load_job")
+    if boot_job is not None and not boot_job.done():
+        st.caption("🚀 Preloading configured model/dataset in the background...")
+    if job is None:
+        return
+    for name, stage in job.progress().items():
+        seconds = f" — {stage['seconds']}s" if stage["seconds"] is not None else ""
+        st.caption(f"{STAGE_ICONS[stage['state']]} {name}{seconds}")
+    if job.done():
+        st.session_state.load_job = None
+        finish_loading(job, st.session_state.load_batch_requests)
+        st.rerun()
+
 
 # Sidebar for model + data loading
 with st.sidebar:
     st.header("Configuration")
-    model_id = st.text_input("Model ID", value="deepseek-ai/deepseek-coder-6.7b-instruct")
+    model_id = st.text_input("Model ID", value=preload["model"] or "deepseek-ai/deepseek-coder-6.7b-instruct")
+    profile_names = list(load_profiles)
+    load_profile = st.selectbox(
+        "Load profile", profile_names,
+        index=profile_names.index(preload["profile"] or default_profile(startup.cuda_hint())),
+    )
     
     dataset_options = [
         "pglib_opf_case14_ieee",
         "pglib_opf_case118_ieee"
     ]
-    selected_case = st.selectbox("Select OPF Dataset Case", dataset_options)
+    selected_case = st.selectbox(
+        "Select OPF Dataset Case", dataset_options,
+        index=dataset_options.index(preload["case"]) if preload["case"] in dataset_options else 0,
+    )
+    batch_requests = st.checkbox(
+        "Batch generation with other users (no token streaming)", value=False
+    )
+    tracing = st.checkbox(
+        "Record per-stage timings", value=bool(os.environ.get("OPF_TRACE_PATH"))
+    )
 
-    if st.button("Load Model and Data"):
+    load_clicked = st.button("Load Model and Data")
+    if load_clicked and SERVICE_URL:
         try:
-            dataset = OPFDataset(root='data', case_name=selected_case)
-            st.session_state.data = dataset # Load the first (and usually only) graph
-            st.session_state.llm = load_model(model_id)
-            st.session_state.code_chain = LLMChain(llm=st.session_state.llm, prompt=code_template)
-            st.session_state.summary_chain = LLMChain(llm=st.session_state.llm, prompt=summary_template)
+            client.load(SERVICE_URL, model_id, load_profile, selected_case)
+            st.session_state.data_key = selected_case
+            st.session_state.llm_key = (model_id, load_profile, "remote")
             st.session_state.model_loaded = True
-            st.success(f"✅ Loaded model and {selected_case}!")
+            st.success(f"✅ Service loaded model and {selected_case}!")
+        except Exception as e:
+            st.error(f"❌ Error reaching the pipeline service: {e}")
+    elif load_clicked and st.session_state.get("load_job") is None:
+        # 🔁 Dataset and model load concurrently off the script thread;
+        # the registries share them across sessions
+        st.session_state.load_job = startup.LoadJob(
+            model_id, load_profile, selected_case, root='data', lease=st.session_state.lease
+        )
+        st.session_state.load_batch_requests = batch_requests
+
+    if not SERVICE_URL:
+        load_progress()
+        if st.session_state.get("load_error"):
+            st.error(f"❌ Error loading model or dataset: {st.session_state.load_error}")
+        elif st.session_state.model_loaded:
+            st.success(f"✅ Loaded model and {st.session_state.data_key}!")
+        if st.session_state.get("load_timings"):
+            st.caption(
+                "⏱️ Startup: "
+                + ", ".join(f"{name} {seconds}s" for name, seconds in st.session_state.load_timings.items()
+                            if seconds is not None)
+            )
+
+    if SERVICE_URL:
+        try:
+            service_status = client.status(SERVICE_URL)
         except Exception as e:
-            st.error(f"❌ Error loading dataset: {e}")
+            service_status = None
+            st.warning(f"⚠️ Pipeline service unreachable: {e}")
+    else:
+        from core.sandbox import pools_snapshot
+
+        query_cache = shared_cache("data/query_cache.sqlite")
+        result_cache = shared_result_cache("data/result_cache")
+        # Load profile stats exist once core.model has been imported
+        model_module = sys.modules.get("core.model")
+        profile_stats = model_module.profile_stats if model_module is not None else {}
+        service_status = {
+            "profiles": [
+                {"model": model_id, "profile": profile, **record}
+                for (model_id, profile), record in profile_stats.items()
+            ],
+            "models": registry.models.snapshot(),
+            "datasets": registry.datasets.snapshot(),
+            "query_cache": query_cache.stats(),
+            "result_cache": result_cache.stats(),
+            "sandbox": pools_snapshot(),
+        }
+
+    if service_status:
+        cache_stats = service_status["query_cache"]
+        st.caption(
+            f"🗃️ Code cache: {cache_stats['entries']} entries, "
+            f"{cache_stats['hits']} hits / {cache_stats['misses']} misses"
+        )
+        result_stats = service_status["result_cache"]
+        st.caption(
+            f"💾 Result cache: {result_stats['entries']} entries, "
+            f"{result_stats['bytes'] / 2**20:.1f} MiB, "
+            f"{result_stats['hits']} hits / {result_stats['misses']} misses"
+        )
+
+    with st.expander("🧠 Resident in this server"):
+        for label, key in (("Models", "models"), ("Datasets", "datasets")):
+            st.markdown(f"**{label}**")
+            entries = service_status[key] if service_status else []
+            if not entries:
+                st.caption("nothing loaded")
+            for entry in entries:
+                st.caption(
+                    f"{entry['key']} — {entry['bytes'] / 2**30:.2f} GiB, "
+                    f"{entry['refs']} session(s), loaded in {entry['load_seconds']}s"
+                )
+        pools = service_status.get("sandbox", []) if service_status else []
+        if pools:
+            st.markdown("**Sandbox workers**")
+            for pool in pools:
+                st.caption(
+                    f"{pool['case']} — {pool['workers']} worker(s), "
+                    f"{pool['private_bytes'] / 2**30:.2f} GiB private"
+                )
+            st.caption(
+                "Each worker keeps its own in-RAM copy of the dataset; "
+                "only the grid is memory-mapped and shared."
+            )
+        if service_status and service_status["profiles"]:
+            st.markdown("**Load profiles**")
+            for record in service_status["profiles"]:
+                st.caption(
+                    f"{record['model']} [{record['profile']}] — load {record['load_seconds']}s, "
+                    f"{record['model_bytes'] / 2**30:.2f} GiB weights, "
+                    f"{record['tokens_per_second'] or '–'} tok/s"
+                )
+
+PAGE_ROWS = 100
+
+
+@st.fragment
+def render_array(key, value, key_prefix="result"):
+    # A fragment, so paging reruns only this table and not the query
+    array = transport.as_array(value)
+    table = array.reshape(array.shape[0], -1) if array.ndim > 1 else array.reshape(-1, 1)
+    pages = max(1, -(-table.shape[0] // PAGE_ROWS))
+    st.markdown(f"**{key}** — shape {list(array.shape)}, {array.dtype}")
+    page = st.number_input(
+        f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=f"{key_prefix}-page-{key}"
+    ) if pages > 1 else 1
+    start = (page - 1) * PAGE_ROWS
+    st.dataframe(table[start:start + PAGE_ROWS], use_container_width=True)
+    st.caption(f"rows {start}–{min(start + PAGE_ROWS, table.shape[0]) - 1} of {table.shape[0]}")
+
+
+def render_result(result_dict, key_prefix="result"):
+    st.subheader("📦 Result Dictionary")
+    values = {k: v for k, v in result_dict.items() if k not in ["plot", "plots"]}
+    large = {k: v for k, v in values.items() if transport.is_large(v)}
+    st.json(transport.jsonable({k: v for k, v in values.items() if k not in large}))
+    for key, value in large.items():
+        render_array(key, value, key_prefix)
+    if large:
+        st.download_button(
+            "⬇️ Download arrays (.npz)",
+            data=transport.to_npz(values),
+            file_name="result.npz",
+            mime="application/octet-stream",
+            key=f"{key_prefix}-download",
+        )
+
+    # 🔹 Handle multiple plots
+    if "plots" in result_dict:
+        all_plots = result_dict["plots"]
+        if all_plots:
+            st.subheader("📊 Plots")
+            # Make sure it's a list, even if it's a single Figure
+            if not isinstance(all_plots, list):
+                all_plots = [all_plots]
+            for i, fig in enumerate(all_plots):
+                st.markdown(f"**Plot {i+1}**")
+                if isinstance(fig, bytes):
+                    st.image(fig)  # already rendered by the executor or a worker
+                else:
+                    st.pyplot(fig, clear_figure=True)
+
+
+    # 🔸 Handle single plot
+    elif "plot" in result_dict:
+        if isinstance(result_dict["plot"], bytes):
+            st.image(result_dict["plot"])
+        else:
+            try:
+                st.pyplot(result_dict["plot"], clear_figure=True)
+            except:
+                st.plotly_chart(result_dict["plot"])
+
+
+def drain(events, pending):
+    # Events pushed back by a token stream are replayed before new ones
+    while True:
+        if pending:
+            yield pending.pop(0)
+            continue
+        try:
+            yield next(events)
+        except StopIteration:
+            return
+
+
+def pump(events, stop, heartbeat, interval=0.5):
+    """Yield ``events`` produced on a helper thread.
+
+    While waiting the script calls ``heartbeat`` (a Streamlit element
+    update), which is where Streamlit notices a rerun or Stop; the run
+    then ends here and ``stop`` cancels the query it left behind.
+    """
+    channel = queue.Queue()
+
+    def produce():
+        try:
+            for event in events:
+                channel.put(("event", event))
+            channel.put(("end", None))
+        except Exception as e:
+            channel.put(("error", e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    finished = False
+    try:
+        while True:
+            try:
+                kind, item = channel.get(timeout=interval)
+            except queue.Empty:
+                heartbeat()
+                continue
+            if kind == "end":
+                finished = True
+                return
+            if kind == "error":
+                finished = True
+                raise item
+            yield item
+    finally:
+        if not finished:
+            stop()
+
+
+def cancel_run():
+    # Cancel button callback: stops this session's query only
+    stop = st.session_state.pop("stop_run", None)
+    if stop is not None:
+        stop()
+
+
+def keep_preview():
+    # Preview button callback: the click's rerun already stopped the full
+    # pass (see pump); the preview stays on screen as the answer
+    st.session_state.kept_preview = st.session_state.pop("last_preview", None)
+    cancel_run()
+
+
+def token_stream(first, events, kind, pending):
+    yield first
+    for event in events:
+        if event["type"] != kind:
+            pending.append(event)
+            return
+        yield event["text"]
+
 
 # Main logic after loading
 if st.session_state.model_loaded:
     st.subheader("💬 Ask a Question")
     query = st.text_area("Enter your prompt", height=150)
+    regenerate = st.checkbox("Force code regeneration (skip cache)", value=False)
+    use_sandbox = st.checkbox("Run generated code in an isolated worker", value=True)
+    sharded = st.checkbox(
+        "Split the dataset across workers when possible", value=False, disabled=not use_sandbox
+    )
+    candidates = st.number_input(
+        "Code candidates to race", min_value=1, max_value=8, value=1, disabled=not use_sandbox
+    )
+    progressive = st.checkbox("Preview on a random subset of samples first", value=False)
+    preview_samples = st.number_input(
+        "Preview samples", min_value=8, max_value=5000, value=200, step=50, disabled=not progressive
+    )
+    preview_only = st.checkbox("Stop after the preview", value=False, disabled=not progressive)
+
+    run_col, cancel_col = st.columns(2)
+    run_clicked = run_col.button("Run Query")
+    if cancel_col.button("Cancel running query", on_click=cancel_run):
+        st.info("⏹️ Query cancelled.")
+    kept = None if run_clicked else st.session_state.get("kept_preview")
+    if kept is not None:
+        st.warning(
+            f"≈ Approximate: full run stopped, showing the preview on {kept['samples']} of "
+            f"{kept['total']} samples (seed {kept['seed']})"
+        )
+        render_result(kept["result"], key_prefix="kept")
 
-    if st.button("Run Query"):
-        with st.spinner("⚙️ Running..."):
-            summary, code, result_dict = run_pipeline(
+    if run_clicked:
+        trace = Trace(query, case=st.session_state.data_key, model=st.session_state.llm_key[0]) if tracing else NULL_TRACE
+        if SERVICE_URL:
+            request_id = uuid.uuid4().hex
+
+            def stop():
+                try:
+                    client.cancel(SERVICE_URL, request_id)
+                except OSError:
+                    pass  # service unreachable: nothing left to stop
+
+            events = client.stream_query(SERVICE_URL, {
+                "request_id": request_id,
+                "query": query,
+                "case": st.session_state.data_key,
+                "model": st.session_state.llm_key[0],
+                "profile": st.session_state.llm_key[1],
+                "regenerate": regenerate,
+                "sandbox": use_sandbox,
+                "sharded": use_sandbox and sharded,
+                "candidates": int(candidates) if use_sandbox else 1,
+                "preview_samples": int(preview_samples) if progressive else 0,
+                "preview_only": progressive and preview_only,
+            })
+        else:
+            from core.executor import stream_pipeline
+            from core.sandbox import shared_pool
+
+            cancel_event = threading.Event()  # one per run: other sessions keep running
+            stop = cancel_event.set
+            events = stream_pipeline(
                 query,
                 st.session_state.code_chain,
                 st.session_state.summary_chain,
                 st.session_state.data,
+                grid=st.session_state.grid,
+                query_cache=query_cache,
+                case_name=st.session_state.data_key,
+                regenerate=regenerate,
+                result_cache=result_cache,
+                sandbox=shared_pool(st.session_state.data_key, root='data') if use_sandbox else None,
+                sharded=use_sandbox and sharded,
+                candidates=int(candidates) if use_sandbox else 1,
+                trace=trace,
+                preview_samples=int(preview_samples) if progressive else 0,
+                preview_only=progressive and preview_only,
+                cancel_event=cancel_event,
             )
+        st.session_state.stop_run = stop
+        st.session_state.pop("kept_preview", None)
+        events = pump(events, stop, st.empty().empty)
+        pending = []
 
         st.subheader("🧠 Generated Code")
-        st.code(code, language="python")
-
-        
-        st.subheader("📦 Result Dictionary")
-        st.json(result_dict)
-
-        # 🔹 Handle multiple plots
-        if "plots" in result_dict:
-            all_plots = result_dict["plots"]
-            if all_plots:
-                st.subheader("📊 Plots")
-                # Make sure it's a list, even if it's a single Figure
-                if not isinstance(all_plots, list):
-                    all_plots = [all_plots]
-                for i, fig in enumerate(all_plots):
-                    st.markdown(f"**Plot {i+1}**")
-                    st.pyplot(fig)
-
-
-        # 🔸 Handle single plot
-        elif "plot" in result_dict:
-            try:
-                st.pyplot(result_dict["plot"])
-            except:
-                st.plotly_chart(result_dict["plot"])
-        
+        code_box = st.empty()
+        status_box = st.empty()
+        result_box = st.empty()
+        summary_box = None
+        streamed_code = ""
+        summary = "Summary not found."
+        token_stats = []
+
+        for event in drain(events, pending):
+            kind = event["type"]
+            if kind == "code_token":
+                streamed_code += event["text"]
+                code_box.code(streamed_code, language="python")
+            elif kind == "cache_hit":
+                st.caption(f"♻️ Reusing cached code (similarity {event['similarity']:.2f})")
+            elif kind == "result_cache_hit":
+                st.caption("⚡ Result served from cache")
+            elif kind == "exec_mode":
+                if event["mode"] == "sharded":
+                    st.caption(f"🧩 Ran on {event['shards']} shards in parallel")
+                else:
+                    st.caption(f"🧩 Ran serially: {event['reason']}")
+            elif kind == "speculative":
+                st.caption(
+                    f"🎲 {event['distinct']} distinct of {event['sampled']} candidates, "
+                    f"{event['finished']} finished before "
+                    + ("a winner" if event["succeeded"] else "all failed")
+                )
+            elif kind == "code":
+                streamed_code = ""
+                code_box.code(event["code"], language="python")
+            elif kind == "retry":
+                st.warning(f"❌ Attempt {event['attempt']} failed: {event['error']}")
+                st.info("🛠️ The LLM is attempting to fix the code and retry...")
+            elif kind == "exec_start":
+                status_box.info(f"⚙️ Running generated code (attempt {event['attempt']})...")
+            elif kind == "preview":
+                status_box.info("⚙️ Preview ready — running on the full dataset...")
+                st.session_state.last_preview = event
+                with result_box.container():
+                    st.warning(
+                        f"≈ Approximate: preview on {event['samples']} of {event['total']} samples "
+                        f"(seed {event['seed']})"
+                    )
+                    render_result(event["result"], key_prefix="preview")
+                    if not (progressive and preview_only):
+                        st.button("⏹️ Keep this preview, stop the full run", on_click=keep_preview,
+                                  key=f"keep-preview-{event['attempt']}")
+            elif kind == "exec_end":
+                status_box.empty()
+                if event["ok"]:
+                    with trace.span("render_result"), result_box.container():
+                        if event.get("approximate"):
+                            st.warning("≈ Approximate: computed on the preview subset only")
+                        render_result(event["result"], key_prefix=f"result-{event['attempt']}")
+            elif kind == "summary_token":
+                summary_box = st.empty()
+                with trace.span("render_summary"):
+                    summary_box.write_stream(token_stream(event["text"], events, kind, pending))
+            elif kind == "generation_stats":
+                token_stats.append(event)
+            elif kind == "error":
+                status_box.empty()
+                st.error(f"❌ Pipeline service error: {event['error']}")
+                summary = "Query failed."
+            elif kind == "done":
+                summary = event["summary"]
+        st.session_state.pop("stop_run", None)
+        st.session_state.pop("last_preview", None)
+
         # Final summary
-        st.success(f"✅ {summary}")
+        (summary_box or st).success(f"✅ {summary}")
+
+        counted = [s for s in token_stats if s["new_tokens"] is not None]
+        if counted:
+            st.caption(
+                "🔢 Tokens generated: "
+                + ", ".join(f"{s['chain']} {s['new_tokens']}/{s['max_new_tokens']}" for s in counted)
+                + f" — saved {sum(s['saved_tokens'] for s in counted)} by stopping early"
+            )
+            queued = [s for s in counted if "queue_seconds" in s]
+            if queued:
+                st.caption(
+                    "📬 Queue time: "
+                    + ", ".join(f"{s['chain']} {s['queue_seconds']}s (batch of {s['batch_size']})" for s in queued)
+                )
+            timed = [s for s in counted if s.get("prefill_seconds") is not None]
+            if timed:
+                st.caption(
+                    "⏱️ Prefill / decode: "
+                    + ", ".join(
+                        f"{s['chain']} {s['prefill_seconds']}s / {s['decode_seconds']}s "
+                        f"({s['prefix_tokens_reused']} prefix tokens reused)"
+                        for s in timed
+                    )
+                )
+
+        if trace.enabled:
+            with st.expander("⏱️ Timings for this query"):
+                st.table([
+                    {
+                        "stage": span["name"],
+                        "ms": span["duration_ms"],
+                        "details": ", ".join(
+                            f"{k}={v}" for k, v in span["attributes"].items() if k != "peak_rss_bytes"
+                        ),
+                        "peak RSS (MiB)": round(span["attributes"]["peak_rss_bytes"] / 2**20),
+                    }
+                    for span in trace.spans
+                ])
+            trace.export(os.environ.get("OPF_TRACE_PATH", "data/traces.jsonl"))
 else:
     st.info("📂 Upload a file and load the model to begin.")
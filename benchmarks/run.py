@@ -0,0 +1,191 @@
+"""Headless benchmark: replay a query corpus through ``run_pipeline``.
+
+    python -m benchmarks.run --stub                      # execution path only, no LLM
+    python -m benchmarks.run --model deepseek-ai/deepseek-coder-6.7b-instruct
+    python -m benchmarks.run --stub --save-baseline      # record a new baseline
+
+Reports p50/p95 per pipeline stage, success rate, retries and peak memory
+per case, and compares against ``benchmarks/baseline.json``.
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+from config.prompts import code_template, summary_template
+from core.executor import run_pipeline
+from core.tracing import Trace, peak_rss_bytes
+
+CASES = ["pglib_opf_case14_ieee", "pglib_opf_case118_ieee"]
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class StubChain:
+    """Deterministic stand-in for an ``LLMChain``: returns canned completions."""
+
+    def __init__(self, prompt, respond):
+        self.prompt = prompt
+        self.llm = None
+        self.respond = respond
+
+    def invoke(self, inputs):
+        return {"text": self.respond(inputs)}
+
+
+def stub_chains(corpus):
+    code_by_query = {entry["query"]: entry["stub_code"] for entry in corpus}
+
+    def code(inputs):
+        query = inputs["query"]
+        if query in code_by_query:
+            return code_by_query[query] + "\n</code>"
+        # Fix-up prompts embed the broken code; hand it back unchanged so a
+        # failing stub keeps failing instead of passing as an empty result
+        broken = re.search(r"<broken-code>\n(.*?)\n</broken-code>", query, re.S)
+        return (broken.group(1) if broken else "") + "\n</correct-code>"
+
+    def summary(inputs):
+        return "Benchmark stub summary.</one-line-summary>"
+
+    return StubChain(code_template, code), StubChain(summary_template, summary)
+
+
+def load_corpus(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return round(ordered[rank], 2)
+
+
+def run_case(case_name, corpus, code_chain, summary_chain, repeat, sandbox):
+    from core.grid import open_case
+
+    started = time.perf_counter()
+    dataset, grid = open_case(case_name, root="data")
+    load_seconds = time.perf_counter() - started
+
+    pool = None
+    if sandbox:
+        from core.sandbox import SandboxPool
+        pool = SandboxPool(case_name, root="data", size=2)
+
+    stages, totals, retries, ok = {}, [], 0, 0
+    for _ in range(repeat):
+        for entry in corpus:
+            trace = Trace(entry["query"], case=case_name, query_id=entry["query_id"])
+            executed = []
+            query_started = time.perf_counter()
+            with trace.span("total"):
+                run_pipeline(
+                    entry["query"], code_chain, summary_chain, dataset,
+                    grid=grid, sandbox=pool, trace=trace,
+                    on_event=lambda e: executed.append(e["ok"]) if e["type"] == "exec_end" else None,
+                )
+            totals.append((time.perf_counter() - query_started) * 1000)
+            # Success means the last execution finished without an error,
+            # whatever the result holds
+            ok += int(bool(executed) and executed[-1])
+            exec_spans = [s for s in trace.spans if s["name"] == "exec"]
+            retries += max(len(exec_spans) - 1, 0)
+            for name, ms in trace.totals().items():
+                stages.setdefault(name, []).append(ms)
+
+    if pool is not None:
+        pool.shutdown()
+
+    runs = repeat * len(corpus)
+    return {
+        "dataset_load_seconds": round(load_seconds, 2),
+        "runs": runs,
+        "success_rate": round(ok / runs, 3) if runs else None,
+        "retries": retries,
+        "peak_rss_mib": round(peak_rss_bytes() / 2**20),
+        "stages_ms": {
+            name: {"p50": percentile(values, 50), "p95": percentile(values, 95)}
+            for name, values in sorted(stages.items())
+        },
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return lines describing stages whose p50 regressed beyond ``tolerance``."""
+    lines = []
+    for case_name, case in report["cases"].items():
+        old_case = baseline.get("cases", {}).get(case_name)
+        if not old_case:
+            continue
+        for stage, timing in case["stages_ms"].items():
+            old = old_case["stages_ms"].get(stage)
+            if not old or not old["p50"] or timing["p50"] is None:
+                continue
+            ratio = timing["p50"] / old["p50"]
+            marker = "REGRESSION" if ratio > 1 + tolerance else ("faster" if ratio < 1 - tolerance else "same")
+            lines.append(f"{case_name:28s} {stage:22s} {old['p50']:>10} -> {timing['p50']:>10} ms  x{ratio:.2f}  {marker}")
+        if case["success_rate"] is not None and old_case.get("success_rate") is not None:
+            if case["success_rate"] < old_case["success_rate"]:
+                lines.append(f"{case_name:28s} success rate {old_case['success_rate']} -> {case['success_rate']}  REGRESSION")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join(HERE, "queries.jsonl"))
+    parser.add_argument("--cases", nargs="+", default=CASES)
+    parser.add_argument("--stub", action="store_true", help="use canned code instead of an LLM")
+    parser.add_argument("--model", default="deepseek-ai/deepseek-coder-6.7b-instruct")
+    parser.add_argument("--profile", default=None, help="load profile from config/profiles.py")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--sandbox", action="store_true", help="execute in a sandbox worker pool")
+    parser.add_argument("--baseline", default=os.path.join(HERE, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--output", default="bench_output.json")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if args.stub:
+        code_chain, summary_chain = stub_chains(corpus)
+    else:
+        from langchain.chains import LLMChain
+        from core.model import load_model
+        llm = load_model(args.model, args.profile)
+        code_chain = LLMChain(llm=llm, prompt=code_template)
+        summary_chain = LLMChain(llm=llm, prompt=summary_template)
+
+    report = {
+        "corpus": os.path.basename(args.corpus),
+        "corpus_versions": sorted({entry.get("version", 1) for entry in corpus}),
+        "llm": "stub" if args.stub else f"{args.model} [{args.profile or 'default'}]",
+        "sandbox": args.sandbox,
+        "cases": {},
+    }
+    for case_name in args.cases:
+        report["cases"][case_name] = run_case(
+            case_name, corpus, code_chain, summary_chain, args.repeat, args.sandbox
+        )
+        print(json.dumps({case_name: report["cases"][case_name]}, indent=2))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("llm") != report["llm"]:
+            print(f"Note: baseline was recorded with {baseline.get('llm')}")
+        print("\n".join(compare(report, baseline, args.tolerance)) or "No comparable stages.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import os
+
+
+def configured_threads():
+    """``OPF_THREADS`` capped to the CPUs this process may run on, else None.
+
+    None keeps torch's own default (one thread per physical core).
+    ``os.cpu_count()`` is not used: it counts SMT siblings and the host's
+    CPUs inside a container, which oversubscribes the cores.
+    """
+    value = os.environ.get("OPF_THREADS")
+    if not value:
+        return None
+    usable = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    return max(1, min(int(value), usable))
+
+
+# ---------------- MODEL LOAD PROFILES ---------------- #
+# dtype: torch dtype name; attn: attn_implementation passed to transformers;
+# quantization: torchao weight-only scheme (needs `pip install torchao`);
+# layout: torchao tensor layout for the quantized weights ("int4_cpu" is
+# required for int4 on CPU, the default layout only has CUDA kernels);
+# compile: wrap the forward pass in torch.compile; threads: torch.set_num_threads
+# (None leaves torch's default)
+load_profiles = {
+    "cuda-fp16": {
+        "device": "cuda",
+        "dtype": "float16",
+        "attn": "sdpa",
+        "quantization": None,
+        "layout": None,
+        "compile": False,
+        "threads": None,
+    },
+    "cpu-bf16-sdpa": {
+        "device": "cpu",
+        "dtype": "bfloat16",
+        "attn": "sdpa",
+        "quantization": None,
+        "layout": None,
+        "compile": False,
+        "threads": configured_threads(),
+    },
+    "cpu-bf16-compiled": {
+        "device": "cpu",
+        "dtype": "bfloat16",
+        "attn": "sdpa",
+        "quantization": None,
+        "layout": None,
+        "compile": True,
+        "threads": configured_threads(),
+    },
+    "cpu-int8-weight-only": {
+        "device": "cpu",
+        "dtype": "bfloat16",
+        "attn": "sdpa",
+        "quantization": "int8_weight_only",
+        "layout": None,
+        "compile": False,
+        "threads": configured_threads(),
+    },
+    "cpu-int4-weight-only": {
+        "device": "cpu",
+        "dtype": "bfloat16",
+        "attn": "sdpa",
+        "quantization": "int4_weight_only",
+        "layout": "int4_cpu",
+        "compile": False,
+        "threads": configured_threads(),
+    },
+    # The original setup, kept for comparison: ~27 GB RAM for a 6.7B model
+    "cpu-fp32-eager": {
+        "device": "cpu",
+        "dtype": "float32",
+        "attn": "eager",
+        "quantization": None,
+        "layout": None,
+        "compile": False,
+        "threads": None,
+    },
+}
+
+
+def default_profile(cuda_available: bool) -> str:
+    """Profile from ``OPF_LOAD_PROFILE``, else the best default for the host."""
+    name = os.environ.get("OPF_LOAD_PROFILE")
+    if name in load_profiles:
+        return name
+    return "cuda-fp16" if cuda_available else "cpu-bf16-sdpa"
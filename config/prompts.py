@@ -1,5 +1,58 @@
+import os
+
 from langchain.prompts import PromptTemplate
 
+# ---------------- GRID SCHEMA ---------------- #
+grid_schema_raw = """
+# PRECOMPUTED COLUMNAR VIEW: `grid` (PREFER THIS)
+
+`grid` holds every sample of `dataset` stacked into single tensors (S = grid.num_samples).
+Column meanings are identical to the per-sample schema below.
+
+- `grid.bus_x`: [S, num_buses, 4]            `grid.bus_y`: [S, num_buses, 2]
+- `grid.generator_x`: [S, num_generators, 11]  `grid.generator_y`: [S, num_generators, 2]
+- `grid.load_x`: [S, num_loads, 2]
+- `grid.shunt_x`: [S, num_shunts, 2]
+- `grid.ac_line_edge_attr`: [S, num_ac_lines, 9]      `grid.ac_line_edge_label`: [S, num_ac_lines, 4]
+- `grid.transformer_edge_attr`: [S, num_transformers, 11]  `grid.transformer_edge_label`: [S, num_transformers, 4]
+- `grid.objective`: [S]
+- `grid.edge_index["ac_line" | "transformer" | "generator_link" | "load_link" | "shunt_link"]`: [2, N], shared by all samples
+
+Example: mean generator active power per generator → `grid.generator_y[:, :, 0].mean(dim=0)`.
+Use batched tensor operations on `grid` instead of Python loops whenever possible.
+
+# SHARED TOPOLOGY INDEX: `topology` (same object as `grid.topology`)
+
+The network topology is fixed for the case and stored once, not per sample.
+
+- `topology.line_from`, `topology.line_to`: [num_ac_lines] AC line endpoint bus indices
+- `topology.transformer_from`, `topology.transformer_to`: [num_transformers] endpoint bus indices
+- `topology.adjacency`: sparse CSR [num_buses, num_buses] bus adjacency (lines + transformers, symmetric)
+- `topology.bus_generator`: sparse CSR [num_buses, num_generators], 1 where a generator sits on a bus
+- `topology.bus_load`: sparse CSR [num_buses, num_loads]
+- `topology.bus_shunt`: sparse CSR [num_buses, num_shunts]
+- `topology.per_bus(values, incidence)`: sums [S, num_items] values to [S, num_buses] with one sparse matmul
+
+Example: per-bus net active injection →
+`topology.per_bus(grid.generator_y[:, :, 0], topology.bus_generator) - topology.per_bus(grid.load_x[:, :, 0], topology.bus_load)`.
+Example: bus degree → `topology.adjacency.to_dense().sum(dim=1)` (small cases) or `topology.adjacency.crow_indices().diff()`.
+
+# PRECOMPUTED METRICS: `metrics` (same object as `grid.metrics`)
+
+Common derived quantities, computed once per case and cached. Use them instead of re-deriving.
+
+- `metrics.line_loading`: [S, num_ac_lines] max(|S_from|, |S_to|) / rate_a (0 where rate_a is 0)
+- `metrics.transformer_loading`: [S, num_transformers] same for transformers
+- `metrics.generator_cost`: [S, num_generators] c2 * pg^2 + c1 * pg + c0
+- `metrics.total_generation_cost`, `metrics.total_generation`, `metrics.total_load`, `metrics.total_reactive_load`: [S]
+- `metrics.voltage_margin_low` (vm - vmin), `metrics.voltage_margin_high` (vmax - vm), `metrics.voltage_margin` (smaller of both): [S, num_buses]; negative = violation
+- `metrics.top_congested(k)`: (loading [S, k], line_index [S, k]) of the k most loaded AC lines per sample
+- `metrics.generator_pg_stats`, `metrics.generator_cost_stats`, `metrics.line_loading_stats`, `metrics.bus_vm_stats`:
+  dicts with "min", "max", "mean", "std" tensors over samples, one entry per generator / line / bus
+
+Example: share of samples with any line above 90% loading → `(metrics.line_loading > 0.9).any(dim=1).float().mean()`.
+"""
+
 # ---------------- CODE TEMPLATE ---------------- #
 code_template_raw = """
 <instruction>
@@ -9,7 +62,7 @@ Your task is to write clean, valid Python code that:
 - Analyzes a power grid dataset stored in the variable `dataset`, a list of PyTorch Geometric `HeteroData` objects.
 - Computes values or generates plots based on the user's request.
 - Respects the exact data schema below — do not assume any additional fields.
-
+""" + grid_schema_raw + """
 # DATA SCHEMA (based on OPFData, with clear names and short forms)
 
 ## NODE TYPES:
@@ -80,11 +133,13 @@ Your task is to write clean, valid Python code that:
   • edge_index: [2, N] — connectivity only
 
 # CODING RULES:
-- You must iterate through all `data` in `dataset`.
+- Prefer vectorized operations on `grid`; only iterate through `data` in `dataset` when `grid` cannot answer the request.
 - Use `matplotlib.pyplot` with `fig, ax = plt.subplots()` for plots.
+- For more than ~10,000 points use `ax.hist`, `ax.hist2d` or `ax.hexbin` (or plot aggregates) instead of raw scatter/line plots.
 - No markdown, comments, triple backticks, or explanations.
 - Store all results in `result` dictionary.
 - If any plots are generated, store them in `result["plots"] = [fig1, fig2, ...]`, or an empty list if none.
+- If every result value can be combined across disjoint subsets of samples, also define `result_merge = {{"<result key>": "<sum|mean|min|max|concat|histogram>", ...}}` with one entry per key in `result` (plots excluded); omit it otherwise.
 
 
 </instruction>
@@ -101,6 +156,29 @@ code_template = PromptTemplate(
     template=code_template_raw
 )
 
+# Generation stops at the closing tag (fix-up prompts answer in <correct-code>)
+code_generation = {
+    "stop": ["</code>", "</correct-code>"],
+    "max_new_tokens": 500,
+}
+
+# ---------------- FUSED BATCH TEMPLATE ---------------- #
+# Many queries share one pass over `dataset`, so each answer is written as
+# init/step/finish callbacks instead of its own loop
+fused_rules_raw = """
+# BATCH MODE (overrides the iteration rules above):
+- Do not loop over `dataset` yourself; it is streamed once for many queries.
+- Define `def init():` returning a state object (for example a dict).
+- Optionally define `def step(state, data):` which is called once for every `data` in `dataset`.
+- Define `def finish(state, result):` which fills the `result` dictionary (including `result["plots"]`).
+- Answers that only need `grid` can skip `step` and do all the work in `finish`.
+"""
+
+fused_code_template = PromptTemplate(
+    input_variables=["query"],
+    template=code_template_raw.replace("</instruction>", fused_rules_raw + "</instruction>", 1)
+)
+
 # ---------------- SUMMARY TEMPLATE ---------------- #
 summary_template_raw = """
 <instruction>
@@ -108,7 +186,8 @@ You are a concise data analyst.
 
 You are given:
 - A user query related to electrical power grid data analysis.
-- The result of executing Python code on the dataset.
+- The result of executing Python code on the dataset. Large arrays are given as a "sketch"
+  (shape, dtype, min, max, mean, std and the first values) instead of every element.
 
 Do not speculate — summarize only what the result dictionary contains with very little reasoning.
 </instruction>
@@ -128,3 +207,16 @@ summary_template = PromptTemplate(
     input_variables=["query", "result"],  # ✅ manually specify this!
     template=summary_template_raw
 )
+
+# One line is all we want back, so keep the budget small
+summary_generation = {
+    "stop": ["</one-line-summary>"],
+    "max_new_tokens": 64,
+}
+
+# Budget for the result shown to the summary chain; large arrays are sketched
+summary_input = {
+    "max_tokens": int(os.environ.get("OPF_SUMMARY_INPUT_TOKENS", 1024)),
+    "head": 5,
+}
+
@@ -0,0 +1,12 @@
+import os
+
+# ---------------- PRELOAD ON BOOT ---------------- #
+# When a model or case is set, the Streamlit app and `python -m core.service`
+# start loading it in the background as soon as the process starts, so the
+# first user does not wait for it.  Set OPF_PRELOAD=0 to turn this off.
+preload = {
+    "enabled": os.environ.get("OPF_PRELOAD", "1") != "0",
+    "model": os.environ.get("OPF_PRELOAD_MODEL"),
+    "profile": os.environ.get("OPF_PRELOAD_PROFILE") or None,
+    "case": os.environ.get("OPF_PRELOAD_CASE"),
+}
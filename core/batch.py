@@ -0,0 +1,191 @@
+"""Batch query mode: many questions, one pass over the dataset.
+
+    python -m core.batch queries.txt --case pglib_opf_case118_ieee --output report.json
+
+The query file is plain text (one question per line) or JSONL with a
+``query`` field.  Code for all queries is generated in batches with the
+fused template, then every query's ``step`` sees each sample of the
+dataset during a single shared scan.  Figures are saved as PNG files in a
+``<report name>_plots`` folder next to the report.
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+
+from config.prompts import code_generation, summary_generation, summary_input
+from core.executor import extract_code, extract_summary
+from core.plots import render_figures
+from core.transport import jsonable, summary_payload
+
+
+def load_queries(path):
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if lines and lines[0].startswith("{"):
+        return [json.loads(line)["query"] for line in lines]
+    return lines
+
+
+def compile_fused(code, grid):
+    """Exec ``code`` and return its ``(init, step, finish)`` callbacks."""
+    scope = {"grid": grid, "topology": grid.topology, "metrics": grid.metrics, "torch": torch}
+    exec(code, scope)
+    if not callable(scope.get("init")) or not callable(scope.get("finish")):
+        raise ValueError("code must define init() and finish(state, result)")
+    step = scope.get("step")
+    return scope["init"], step if callable(step) else None, scope["finish"]
+
+
+def run_fused(codes, dataset, grid):
+    """Run every code block's callbacks over one shared scan of ``dataset``.
+
+    Returns one ``{"result", "error"}`` per code block, with figures
+    rendered to PNG bytes; a failing query is dropped from the scan without
+    affecting the others.
+    """
+    outcomes = [{"result": {}, "error": None} for _ in codes]
+    active = []  # (index, state, step, finish)
+    for i, code in enumerate(codes):
+        if code is None:
+            outcomes[i]["error"] = "Code not found"
+            continue
+        try:
+            init, step, finish = compile_fused(code, grid)
+            active.append([i, init(), step, finish])
+        except Exception as e:
+            outcomes[i]["error"] = str(e)
+
+    stepping = [entry for entry in active if entry[2] is not None]
+    samples = 0
+    if stepping:
+        for data in dataset:
+            samples += 1
+            for entry in list(stepping):
+                try:
+                    entry[2](entry[1], data)
+                except Exception as e:
+                    outcomes[entry[0]]["error"] = f"step failed on sample {samples - 1}: {e}"
+                    stepping.remove(entry)
+                    active.remove(entry)
+
+    for i, state, _, finish in active:
+        try:
+            result = {}
+            finish(state, result)
+            outcomes[i]["result"] = render_figures(result)
+        except Exception as e:
+            outcomes[i]["error"] = str(e)
+    return outcomes, samples
+
+
+def run_batch(queries, code_chain, dataset, grid, summary_chain=None, batch_size=4):
+    """Generate, execute and (optionally) summarize ``queries`` together."""
+    from core.model import generate_chain_batch
+
+    timings = {}
+    started = time.perf_counter()
+    outputs = generate_chain_batch(
+        code_chain, [{"query": q} for q in queries], batch_size=batch_size, **code_generation
+    )
+    codes = [extract_code(o) for o in outputs]
+    timings["generation_seconds"] = round(time.perf_counter() - started, 2)
+
+    started = time.perf_counter()
+    outcomes, samples = run_fused(codes, dataset, grid)
+    timings["fused_pass_seconds"] = round(time.perf_counter() - started, 2)
+
+    reports = []
+    for query, code, outcome in zip(queries, codes, outcomes):
+        serializable = jsonable({k: v for k, v in outcome["result"].items() if k not in ["plot", "plots"]})
+        reports.append({
+            "query": query,
+            "code": code,
+            "error": outcome["error"],
+            "result": serializable,
+            "plots": len(outcome["result"].get("plots") or []),
+            "summary": None,
+        })
+
+    if summary_chain is not None:
+        started = time.perf_counter()
+        ok = [(r, o) for r, o in zip(reports, outcomes) if r["error"] is None]
+        summaries = generate_chain_batch(
+            summary_chain,
+            [{"query": r["query"], "result": summary_payload(o["result"], **summary_input)} for r, o in ok],
+            batch_size=batch_size,
+            **summary_generation,
+        )
+        for (report, _), summary in zip(ok, summaries):
+            report["summary"] = extract_summary(summary)
+        timings["summary_seconds"] = round(time.perf_counter() - started, 2)
+
+    combined = {
+        "queries": len(queries),
+        "succeeded": sum(r["error"] is None for r in reports),
+        "samples_scanned_once": samples,
+        "timings": timings,
+    }
+    return reports, combined, [o["result"] for o in outcomes]
+
+
+def write_plots(results, output):
+    """Write every rendered figure next to the ``output`` report.
+
+    Images go to ``<report name>_plots/q<query>_<n>.png``; returns the paths,
+    relative to the report's directory, per query.
+    """
+    base = os.path.dirname(os.path.abspath(output))
+    folder = os.path.splitext(os.path.basename(output))[0] + "_plots"
+    paths = []
+    for q, result in enumerate(results):
+        images = result.get("plots") or []
+        if result.get("plot"):
+            images = [result["plot"]] + list(images)
+        written = []
+        for n, image in enumerate(i for i in images if isinstance(i, bytes)):
+            os.makedirs(os.path.join(base, folder), exist_ok=True)
+            path = os.path.join(folder, f"q{q}_{n}.png")
+            with open(os.path.join(base, path), "wb") as f:
+                f.write(image)
+            written.append(path)
+        paths.append(written)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("queries")
+    parser.add_argument("--case", default="pglib_opf_case14_ieee")
+    parser.add_argument("--model", default="deepseek-ai/deepseek-coder-6.7b-instruct")
+    parser.add_argument("--profile", default=None)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--summarize", action="store_true")
+    parser.add_argument("--output", default="batch_report.json")
+    args = parser.parse_args()
+
+    from langchain.chains import LLMChain
+    from config.prompts import fused_code_template, summary_template
+    from core.grid import open_case
+    from core.model import load_model
+
+    queries = load_queries(args.queries)
+    dataset, grid = open_case(args.case, root="data")
+    llm = load_model(args.model, args.profile)
+    code_chain = LLMChain(llm=llm, prompt=fused_code_template)
+    summary_chain = LLMChain(llm=llm, prompt=summary_template) if args.summarize else None
+
+    reports, combined, results = run_batch(
+        queries, code_chain, dataset, grid, summary_chain=summary_chain, batch_size=args.batch_size
+    )
+    for report, paths in zip(reports, write_plots(results, args.output)):
+        report["plot_files"] = paths
+    with open(args.output, "w") as f:
+        json.dump({"case": args.case, "summary": combined, "queries": reports}, f, indent=2)
+    print(json.dumps(combined, indent=2))
+
+
+if __name__ == "__main__":
+    main()
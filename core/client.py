@@ -0,0 +1,75 @@
+import base64
+import json
+import urllib.request
+
+
+def _post(url, payload, timeout):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    return urllib.request.urlopen(request, timeout=timeout)
+
+
+def _decode_result(event):
+    result = event.get("result")
+    if not result:
+        return event
+    from core.transport import decode_value
+
+    event["result"] = result = {
+        k: v if k in ("plot", "plots") else decode_value(v) for k, v in result.items()
+    }
+    if result.get("plots"):
+        result["plots"] = [base64.b64decode(v) for v in result["plots"] if v]
+    if result.get("plot"):
+        result["plot"] = base64.b64decode(result["plot"])
+    return event
+
+
+def load(service_url, model_id, profile, case_name, timeout=3600):
+    payload = {"model": model_id, "profile": profile, "case": case_name}
+    with _post(f"{service_url}/load", payload, timeout) as response:
+        return json.load(response)
+
+
+def cancel(service_url, request_id, keep_preview=False, timeout=10):
+    """Stop the query streamed with ``payload["request_id"] == request_id``.
+
+    With ``keep_preview`` only the full pass stops and the query finishes
+    on its preview.
+    """
+    payload = {"request_id": request_id, "keep_preview": keep_preview}
+    with _post(f"{service_url}/cancel", payload, timeout) as response:
+        return json.load(response)["cancelled"]
+
+
+def status(service_url, timeout=10):
+    with urllib.request.urlopen(f"{service_url}/status", timeout=timeout) as response:
+        return json.load(response)
+
+
+def stream_query(service_url, payload, timeout=3600):
+    """Yield pipeline events from the service.
+
+    Figures are decoded to PNG bytes and large arrays to NumPy arrays.  A
+    failure after the stream started arrives as an ``error`` event.  A
+    ``request_id`` in ``payload`` lets :func:`cancel` stop the query.
+    """
+    with _post(f"{service_url}/query/stream", payload, timeout) as response:
+        for line in response:
+            if line.strip():
+                yield _decode_result(json.loads(line))
+
+
+def run_query(service_url, payload, timeout=3600):
+    """Blocking remote counterpart of ``run_pipeline``."""
+    final = {"summary": "Code not found", "code": "", "result": {}}
+    for event in stream_query(service_url, payload, timeout):
+        if event["type"] == "error":
+            raise RuntimeError(event["error"])
+        if event["type"] == "done":
+            final = event
+    return final["summary"], final["code"], final["result"]
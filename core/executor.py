@@ -1,8 +1,21 @@
 import re
-import streamlit as st
-import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
 import torch
 from torch_geometric.data import HeteroData
+from config.prompts import grid_schema_raw, code_generation, summary_generation, summary_input
+from core.model import generate_candidates, stream_chain, template_prefix
+from core.query_cache import prompt_fingerprint
+from core.grid import dataset_version, sample_indices, select_samples
+from core.sharding import NotShardSafe, run_sharded
+from core.tracing import NULL_TRACE, CountingDataset
+from core.transport import summary_payload
+from core.plots import render_figures
+from core.result_cache import code_hash
+
+# Full runs continue here while the caller shows the preview
+_background = ThreadPoolExecutor(max_workers=4, thread_name_prefix="full-run")
 
 code_template_raw2 = """
 <instruction>
@@ -12,7 +25,7 @@ Your task is to write clean, valid Python code that:
 - Analyzes a power grid dataset stored in the variable `dataset`, a list of PyTorch Geometric `HeteroData` objects.
 - Computes values or generates plots based on the user's request.
 - Respects the exact data schema below — do not assume any additional fields.
-
+""" + grid_schema_raw + """
 # DATA SCHEMA (based on OPFData, with clear names and short forms)
 
 ## Global Fields:
@@ -90,56 +103,288 @@ Your task is to write clean, valid Python code that:
   • edge_index: [2, N] — connectivity only
 
 # CODING RULES:
-- You must iterate through all `data` in `dataset`.
+- Prefer vectorized operations on `grid`; only iterate through `data` in `dataset` when `grid` cannot answer the request.
 - Use `matplotlib.pyplot` with `fig, ax = plt.subplots()` for plots.
+- For more than ~10,000 points use `ax.hist`, `ax.hist2d` or `ax.hexbin` (or plot aggregates) instead of raw scatter/line plots.
 - No markdown, comments, triple backticks, or explanations.
 - Store all results in `result` dictionary.
 - If any plots are generated, store them in `result["plots"] = [fig1, fig2, ...]`, or an empty list if none.
+- If every result value can be combined across disjoint subsets of samples, also define `result_merge = {"<result key>": "<sum|mean|min|max|concat|histogram>", ...}` with one entry per key in `result` (plots excluded); omit it otherwise.
 </instruction>
 """ 
-def run_pipeline(query, code_chain, summary_chain, dataset: HeteroData):
+def extract_code(text):
+    code_match = re.search(r"<code>(.*?)</code>", text, re.DOTALL) or \
+                 re.search(r"```(?:python)?\n?(.*?)\n?```", text, re.DOTALL)
+    if code_match:
+        code_block = code_match.group(1)
+    else:
+        # The prompt already opened the tag, so the model only closes it.
+        closing = re.search(r"(.*?)</(?:correct-)?code>", text, re.DOTALL)
+        if not closing:
+            return None
+        code_block = closing.group(1)
+
+    code_block = code_block.strip()
+    if code_block.startswith("```"):
+        code_block = re.sub(r"^```(?:python)?\n?", "", code_block)
+        code_block = re.sub(r"\n?```$", "", code_block)
+    return code_block.strip()
+
+
+def extract_summary(text):
+    summary_match = re.search(r"<one-line-summary>(.*?)</one-line-summary>", text, re.DOTALL) or \
+                    re.search(r"(.*?)</one-line-summary>", text, re.DOTALL)
+    return summary_match.group(1).strip() if summary_match else "Summary not found."
+
+
+def has_result(result):
+    """Shape check for speculative candidates: some value or plot came back."""
+    if not isinstance(result, dict):
+        return False
+    if any(k not in ["plot", "plots"] for k in result):
+        return True
+    return bool(result.get("plots") or result.get("plot"))
+
+
+def _token_counter(chain):
+    """Exact prompt token count when the chain wraps a HF pipeline."""
+    tokenizer = getattr(getattr(getattr(chain, "llm", None), "pipeline", None), "tokenizer", None)
+    if tokenizer is None:
+        return None
+    return lambda text: len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+def stream_pipeline(query, code_chain, summary_chain, dataset: HeteroData, grid=None,
+                    query_cache=None, case_name=None, regenerate=False, result_cache=None,
+                    sandbox=None, sharded=False, candidates=1, trace=NULL_TRACE,
+                    summary_tokens=None, preview_samples=0, preview_only=False, preview_seed=0,
+                    cancel_event=None, keep_preview=None):
+    """Run a query, yielding progress events as they happen.
+
+    Events are dicts with a ``type`` of ``code_token``, ``code``, ``retry``,
+    ``exec_start``, ``exec_end``, ``summary_token``, ``generation_stats``,
+    ``cache_hit``, ``result_cache_hit``, ``exec_mode``, ``speculative`` or
+    ``done``; the final
+    ``done`` event carries ``summary``, ``code`` and ``result``.
+
+    With a ``query_cache``, code that previously ran for the same (or a
+    similar) query on ``case_name`` is reused instead of generating, unless
+    ``regenerate`` is set.  With a ``result_cache``, code that already ran
+    on this exact dataset returns its stored result and summary without
+    executing or summarizing again.  With a ``sandbox`` pool the code runs
+    in an isolated worker process instead of this one; adding ``sharded``
+    splits the dataset across the pool's workers and merges the shard
+    results with the code's ``result_merge`` spec, falling back to a single
+    worker when the code is not shard-safe.  With ``candidates > 1`` and a
+    sandbox, that many code blocks are sampled in one batched generate call
+    and raced in the pool; the first one returning a result wins.  The
+    summary chain sees a sketch of the result bounded by ``summary_tokens``
+    (``summary_input["max_tokens"]`` by default).  With ``preview_samples``
+    the code first runs on that many randomly chosen (``preview_seed``)
+    samples and a ``preview`` event carries the approximate result; the
+    full run then proceeds on a background thread and its exact result
+    follows in ``exec_end``.  ``preview_only`` stops after the preview, and
+    ``done`` is then flagged ``approximate``; setting the ``keep_preview``
+    event once the preview is out does the same mid-run and cancels the
+    full pass.  Setting ``cancel_event`` (one per run) stops this run's
+    sandbox jobs, or in-process code at its next dataset read, and ends the
+    stream with a ``done`` event flagged ``cancelled``, without retrying or
+    summarizing.  Closing the stream early cancels a pending full pass.
+    Every stage is recorded as a span on ``trace`` (a no-op by default).
+    """
     result = {}
     torch.cuda.empty_cache()
     max_attempts = 2  # 🔁 Retry up to N times on failure
 
-    raw_code_output = code_chain.invoke({"query": query})
-    llm_code_output = raw_code_output.get("text", "") if isinstance(raw_code_output, dict) else str(raw_code_output)
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    fingerprint = prompt_fingerprint(code_chain.prompt.template, code_template_raw2)
+    cached = None
+    if query_cache is not None and not regenerate:
+        with trace.span("query_cache_lookup") as span:
+            cached = query_cache.get(query, case_name, fingerprint)
+            span["hit"] = cached is not None
 
-    code_match = re.search(r"<code>(.*?)</code>", llm_code_output, re.DOTALL) or \
-                 re.search(r"```(?:python)?\n?(.*?)\n?```", llm_code_output, re.DOTALL)
+    speculative_outcome = None
+    if cached is not None:
+        code_block, similarity = cached
+        yield {"type": "cache_hit", "similarity": similarity}
+    elif candidates > 1 and sandbox is not None:
+        with trace.span("code_generation", candidates=candidates):
+            outputs = generate_candidates(code_chain, {"query": query}, candidates, **code_generation)
+        codes = [c for c in (extract_code(o) for o in outputs) if c]
+        codes = list(dict.fromkeys(codes))  # identical samples only need one run
+        code_block = codes[0] if codes else None
+        if codes:
+            with trace.span("exec_speculative", distinct=len(codes)) as span:
+                winner, outcome, finished = sandbox.race(
+                    codes, accept=has_result, cancel_event=cancel_event
+                )
+                span.update(finished=finished, succeeded=winner is not None)
+            if winner is not None:
+                code_block, speculative_outcome = codes[winner], outcome
+            else:
+                speculative_outcome = outcome[0]
+            yield {
+                "type": "speculative",
+                "sampled": len(outputs),
+                "distinct": len(codes),
+                "finished": finished,
+                "succeeded": winner is not None,
+            }
+    else:
+        llm_code_output = ""
+        stats = {}
+        with trace.span("code_generation") as span:
+            for chunk in stream_chain(code_chain, {"query": query}, stats=stats, **code_generation):
+                llm_code_output += chunk
+                yield {"type": "code_token", "text": chunk}
+            span.update(stats)
+        yield {"type": "generation_stats", "chain": "code", **stats}
+        with trace.span("extract_code"):
+            code_block = extract_code(llm_code_output)
 
-    if not code_match:
-        return "Code not found", "", {}
+    if code_block is None:
+        yield {"type": "done", "summary": "Code not found", "code": "", "result": {}}
+        return
+    yield {"type": "code", "code": code_block}
 
-    code_block = code_match.group(1).strip()
-    if code_block.startswith("```"):
-        code_block = re.sub(r"^```(?:python)?\n?", "", code_block)
-        code_block = re.sub(r"\n?```$", "", code_block)
-    code_block = code_block.strip()
+    if result_cache is not None:
+        data_fingerprint = dataset_version(dataset, case_name)
+    if result_cache is not None and speculative_outcome is None:
+        with trace.span("result_cache_lookup") as span:
+            memo = result_cache.get(result_cache.key(code_block, case_name, data_fingerprint))
+            span["hit"] = memo is not None
+        if memo is not None:
+            yield {"type": "result_cache_hit"}
+            yield {"type": "exec_end", "attempt": 0, "ok": True, "result": memo["result"]}
+            yield {"type": "done", "summary": memo["summary"], "code": code_block, "result": memo["result"]}
+            return
+
+    def execute(code, shard, stats, cancel=cancel_event):
+        """Run ``code`` on ``shard`` of the data; returns ``(result, mode, note)``.
+
+        In process, ``cancel`` takes effect at the next sample the code reads.
+        """
+        if sandbox is not None and sharded and shard is None:
+            try:
+                result = run_sharded(code, sandbox, len(dataset), stats=stats, cancel_event=cancel)
+                return result, "sharded", None
+            except NotShardSafe as e:
+                return sandbox.run(code, stats=stats, cancel_event=cancel), "sandbox", str(e)
+        if sandbox is not None:
+            return sandbox.run(code, shard=shard, stats=stats, cancel_event=cancel), "sandbox", None
+        scoped_dataset, scoped_grid = select_samples(dataset, grid, shard)
+        counted = CountingDataset(scoped_dataset, cancel_event=cancel)
+        exec_scope = {
+            "dataset": counted,
+            "grid": scoped_grid,
+            "topology": scoped_grid.topology if scoped_grid is not None else None,
+            "metrics": scoped_grid.metrics if scoped_grid is not None else None,
+            "result": {},
+            "torch": torch,
+        }
+        exec(code, exec_scope)
+        if trace.enabled:
+            stats["samples_touched"] = counted.samples_touched
+        # Workers render their own figures; do the same here so figures
+        # are closed and cached results hold only bytes
+        source = f"{code_hash(code)}|{case_name}|{dataset_version(dataset, case_name)}|{shard}"
+        return render_figures(exec_scope.get("result", {}), source=source), "in_process", None
+
+    preview = None
+    if preview_samples and len(dataset) > preview_samples:
+        preview = sample_indices(len(dataset), preview_samples, preview_seed)
+    approximate = False
 
     attempt = 0
     error_message = ""
-    while attempt < max_attempts:
-        try:
-            exec_scope = {
-                "dataset": dataset,
-                "result": result,
-                "torch": torch,
-                "st": st,
-            }
-            exec(code_block, exec_scope)
-            result = exec_scope.get("result", {})
-            break  # ✅ Success, break the loop
-        except Exception as e:
-            error_message = str(e)
-            attempt += 1
-            if attempt >= max_attempts:
-                return f"Execution error after {max_attempts} attempts: {error_message}", code_block, {}
-
-            # 🔧 Ask LLM to fix the broken code
-            st.warning(f"❌ Attempt {attempt} failed: {error_message}")
-            st.info("🛠️ The LLM is attempting to fix the code and retry...")
-            fix_prompt = f"""{code_template_raw2}
+    full_run, full_cancel = None, threading.Event()
+    try:
+        while attempt < max_attempts:
+            yield {"type": "exec_start", "attempt": attempt + 1}
+            try:
+                full_run = None
+                exec_stats = {}
+                if preview is not None and speculative_outcome is None:
+                    # Runtime errors surface here in seconds, before the full pass
+                    with trace.span("exec_preview", attempt=attempt + 1, samples=len(preview)) as span:
+                        preview_stats = {}
+                        preview_result, span["mode"], _ = execute(code_block, preview, preview_stats)
+                        span.update(preview_stats)
+                    if not preview_only:
+                        full_run = _background.submit(execute, code_block, None, exec_stats, full_cancel)
+                    yield {
+                        "type": "preview",
+                        "attempt": attempt + 1,
+                        "result": preview_result,
+                        "samples": len(preview),
+                        "total": len(dataset),
+                        "seed": preview_seed,
+                    }
+
+                with trace.span("exec", attempt=attempt + 1) as span:
+                    if speculative_outcome is not None:
+                        # Already executed while racing the candidates
+                        outcome, speculative_outcome = speculative_outcome, None
+                        span["mode"] = "speculative"
+                        if isinstance(outcome, Exception):
+                            raise outcome
+                        result = outcome
+                    elif preview is not None and preview_only:
+                        span["mode"] = "preview"
+                        result, approximate = preview_result, True
+                    else:
+                        if full_run is not None:
+                            # Wait for the full pass, watching for cancel / keep-preview
+                            while not wait([full_run], timeout=0.1).done:
+                                if cancelled() or (keep_preview is not None and keep_preview.is_set()):
+                                    full_cancel.set()
+                                    break
+                        if full_run is not None and not full_run.done():
+                            if cancelled():
+                                raise RuntimeError("Execution cancelled")
+                            span["mode"] = "preview"
+                            result, approximate, note = preview_result, True, None
+                        elif full_run is not None:
+                            result, span["mode"], note = full_run.result()
+                        else:
+                            result, span["mode"], note = execute(code_block, None, exec_stats)
+                        if span["mode"] == "sharded":
+                            yield {"type": "exec_mode", "mode": "sharded", "shards": sandbox.size}
+                        elif note is not None:
+                            yield {"type": "exec_mode", "mode": "serial", "reason": note}
+                    span.update(exec_stats)
+                if query_cache is not None:
+                    query_cache.put(query, case_name, fingerprint, code_block)
+                yield {
+                    "type": "exec_end",
+                    "attempt": attempt + 1,
+                    "ok": True,
+                    "result": result,
+                    "approximate": approximate,
+                }
+                break  # ✅ Success, break the loop
+            except Exception as e:
+                if cancelled():
+                    yield {"type": "done", "summary": "Cancelled", "code": code_block, "result": {}, "cancelled": True}
+                    return
+                error_message = str(e)
+                attempt += 1
+                yield {"type": "exec_end", "attempt": attempt, "ok": False, "error": error_message}
+                if attempt >= max_attempts:
+                    yield {
+                        "type": "done",
+                        "summary": f"Execution error after {max_attempts} attempts: {error_message}",
+                        "code": code_block,
+                        "result": {},
+                    }
+                    return
+
+                # 🔧 Ask LLM to fix the broken code
+                yield {"type": "retry", "attempt": attempt, "error": error_message}
+                fix_prompt = f"""{code_template_raw2}
 <user>
 The following code failed. Fix it. Return only clean Python code completely inside 'correct-code' tag.
 </user>
@@ -151,38 +396,77 @@ The following code failed. Fix it. Return only clean Python code completely insi
 </error-message>
 <correct-code>
 """
-            fixed_output = code_chain.invoke({"query": fix_prompt})
-            code_block = fixed_output.get("text", "") if isinstance(fixed_output, dict) else str(fixed_output)
-
-            fixed_match = re.search(r"<code>(.*?)</code>", code_block, re.DOTALL) or \
-                          re.search(r"```(?:python)?\n?(.*?)\n?```", code_block, re.DOTALL)
-            if fixed_match:
-                code_block = fixed_match.group(1).strip()
-
-    # 🧼 Post-processing for JSON
-    def make_serializable(v):
-        if isinstance(v, torch.Tensor):
-            return v.tolist()
-        if isinstance(v, dict):
-            return {k: make_serializable(vv) for k, vv in v.items()}
-        if isinstance(v, list):
-            return [make_serializable(vv) for vv in v]
-        return v
-
-    serializable_result = {
-        k: make_serializable(v)
-        for k, v in result.items()
-        if k not in ["plot", "plots"]
-    }
+                fixed_output = ""
+                stats = {}
+                # The fix-up prompt repeats the whole schema: reuse its KV prefix too
+                fix_prefix = template_prefix(code_chain.prompt) + code_template_raw2
+                with trace.span("fix_generation", attempt=attempt) as span:
+                    for chunk in stream_chain(code_chain, {"query": fix_prompt}, stats=stats,
+                                              prefix=fix_prefix, **code_generation):
+                        fixed_output += chunk
+                        yield {"type": "code_token", "text": chunk}
+                    span.update(stats)
+                yield {"type": "generation_stats", "chain": "fix", **stats}
+                code_block = extract_code(fixed_output) or fixed_output.strip()
+                yield {"type": "code", "code": code_block}
+    finally:
+        if full_run is not None and not full_run.done():
+            # The consumer stopped (or kept the preview) while the full
+            # pass was still running: don't leave it busy in the background
+            full_cancel.set()
+            full_run.cancel()
+
+    if cancelled():
+        yield {"type": "done", "summary": "Cancelled", "code": code_block, "result": result, "cancelled": True}
+        return
+
+    # 🧼 Bounded sketch of the result for the summary prompt
+    with trace.span("serialize") as span:
+        result_json = summary_payload(
+            result,
+            max_tokens=summary_tokens or summary_input["max_tokens"],
+            head=summary_input["head"],
+            count_tokens=_token_counter(summary_chain),
+        )
+        span["chars"] = len(result_json)
     torch.cuda.empty_cache()
 
     # 🧠 Summarize output
-    raw_summary_output = summary_chain.invoke({
+    summary_output = ""
+    shown = ""
+    summary_inputs = {
         "query": query,
-        "result": json.dumps(serializable_result, indent=2)
-    })
-    summary_output = raw_summary_output.get("text", "") if isinstance(raw_summary_output, dict) else str(raw_summary_output)
-    summary_match = re.search(r"<one-line-summary>(.*?)</one-line-summary>", summary_output, re.DOTALL)
-    summary = summary_match.group(1).strip() if summary_match else "Summary not found."
+        "result": result_json
+    }
+    stats = {}
+    with trace.span("summary_generation") as span:
+        for chunk in stream_chain(summary_chain, summary_inputs, stats=stats, **summary_generation):
+            summary_output += chunk
+            visible = summary_output.split(summary_generation["stop"][0])[0]
+            if len(visible) > len(shown):
+                yield {"type": "summary_token", "text": visible[len(shown):]}
+                shown = visible
+        span.update(stats)
+    yield {"type": "generation_stats", "chain": "summary", **stats}
+    summary = extract_summary(summary_output)
+
+    if result_cache is not None and not approximate:
+        with trace.span("result_cache_store"):
+            result_cache.put(result_cache.key(code_block, case_name, data_fingerprint), result, summary)
+
+    yield {"type": "done", "summary": summary, "code": code_block, "result": result, "approximate": approximate}
+
+
+def run_pipeline(query, code_chain, summary_chain, dataset: HeteroData, grid=None,
+                 on_event=None, **options):
+    """Blocking wrapper around :func:`stream_pipeline`.
 
-    return summary, code_block, result
+    ``on_event`` is called with every progress event, e.g. to log retries.
+    """
+    final = {"summary": "Code not found", "code": "", "result": {}}
+    for event in stream_pipeline(query, code_chain, summary_chain, dataset, grid=grid, **options):
+        if on_event is not None:
+            on_event(event)
+        if event["type"] == "done":
+            final = event
+    return final["summary"], final["code"], final["result"]
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+
+# (store key, attribute, grid field name)
+NODE_FIELDS = [
+    ("bus", "x", "bus_x"),
+    ("bus", "y", "bus_y"),
+    ("generator", "x", "generator_x"),
+    ("generator", "y", "generator_y"),
+    ("load", "x", "load_x"),
+    ("shunt", "x", "shunt_x"),
+]
+
+EDGE_TYPES = {
+    "ac_line": ("bus", "ac_line", "bus"),
+    "transformer": ("bus", "transformer", "bus"),
+    "generator_link": ("generator", "generator_link", "bus"),
+    "load_link": ("load", "load_link", "bus"),
+    "shunt_link": ("shunt", "shunt_link", "bus"),
+}
+
+EDGE_FIELDS = [
+    ("ac_line", "edge_attr"),
+    ("ac_line", "edge_label"),
+    ("transformer", "edge_attr"),
+    ("transformer", "edge_label"),
+]
+
+GLOBAL_FIELDS = [
+    ("x", "global_x"),
+    ("objective", "objective"),
+]
+
+
+class OPFGrid:
+    """Columnar view of an OPF dataset: every field stacked over samples.
+
+    Node and edge features become ``[num_samples, num_items, num_features]``
+    tensors and global fields ``[num_samples]`` (or ``[num_samples, k]``).
+    The topology is fixed within a pglib case, so ``edge_index`` is kept once
+    per edge type instead of per sample.
+    """
+
+    def __init__(self, num_samples, fields, edge_index, topology=None, metrics=None, cache_dir=None):
+        self.num_samples = num_samples
+        self.edge_index = edge_index
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self._fields = list(fields)
+        self._topology = topology
+        self._metrics = metrics
+        self.cache_dir = cache_dir
+
+    @property
+    def topology(self):
+        """Shared :class:`core.topology.Topology` index, built on first use."""
+        if self._topology is None:
+            from core.topology import Topology
+
+            self._topology = Topology.from_grid(self)
+        return self._topology
+
+    @property
+    def metrics(self):
+        """:class:`core.metrics.MetricCatalog` of derived quantities, cached on disk."""
+        if self._metrics is None:
+            from core.metrics import MetricCatalog
+
+            directory = os.path.join(self.cache_dir, "metrics") if self.cache_dir else None
+            self._metrics = MetricCatalog(self, directory)
+        return self._metrics
+
+    def fields(self):
+        return {name: getattr(self, name) for name in self._fields}
+
+    def __len__(self):
+        return self.num_samples
+
+    def slice(self, start, end):
+        """View of samples ``start:end`` (no copy; topology is shared)."""
+        fields = {name: value[start:end] for name, value in self.fields().items()}
+        num_samples = len(range(*slice(start, end).indices(self.num_samples)))
+        return OPFGrid(num_samples, fields, self.edge_index, self._topology, self.metrics.slice(start, end))
+
+    def subset(self, indices):
+        """Copy of the samples at ``indices``; metrics are recomputed for them."""
+        index = torch.as_tensor(indices, dtype=torch.long)
+        fields = {name: value[index] for name, value in self.fields().items()}
+        return OPFGrid(index.numel(), fields, self.edge_index, self.topology)
+
+    def __repr__(self):
+        shapes = ", ".join(f"{name}={list(getattr(self, name).shape)}" for name in self._fields)
+        return f"OPFGrid(num_samples={self.num_samples}, {shapes})"
+
+
+def _collated_view(dataset, key, attr, first):
+    """Reshape the collated storage of an ``InMemoryDataset`` without copying."""
+    data = getattr(dataset, "_data", None)
+    slices = getattr(dataset, "slices", None)
+    if data is None or slices is None or getattr(dataset, "_indices", None) is not None:
+        return None
+    try:
+        store = data if key is None else data[key]
+        bounds = slices[attr] if key is None else slices[key][attr]
+        value = store[attr]
+    except (KeyError, AttributeError):
+        return None
+
+    sizes = bounds[1:] - bounds[:-1]
+    if sizes.numel() == 0 or not bool((sizes == sizes[0]).all()):
+        return None
+    if value.numel() != sizes.numel() * max(first.numel(), 1):
+        return None
+    return value.view(sizes.numel(), *first.shape)
+
+
+def _stack_field(dataset, key, attr):
+    first = dataset[0] if key is None else dataset[0][key]
+    if attr not in first:
+        return None
+    first = first[attr]
+    view = _collated_view(dataset, key, attr, first)
+    if view is not None:
+        return view
+    # Fallback: materialize every sample once (subsets, ragged collations).
+    return torch.stack([
+        (data if key is None else data[key])[attr] for data in dataset
+    ])
+
+
+def build_grid(dataset):
+    num_samples = len(dataset)
+    fields = {}
+
+    for key, attr, name in NODE_FIELDS:
+        value = _stack_field(dataset, key, attr)
+        if value is not None:
+            fields[name] = value
+
+    for edge_name, attr in EDGE_FIELDS:
+        value = _stack_field(dataset, EDGE_TYPES[edge_name], attr)
+        if value is not None:
+            fields[f"{edge_name}_{attr}"] = value
+
+    for attr, name in GLOBAL_FIELDS:
+        value = _stack_field(dataset, None, attr)
+        if value is not None:
+            fields[name] = value.reshape(num_samples, -1).squeeze(-1)
+
+    first = dataset[0]
+    edge_index = {
+        name: first[edge_type].edge_index
+        for name, edge_type in EDGE_TYPES.items()
+        if edge_type in first.edge_types
+    }
+    return OPFGrid(num_samples, fields, edge_index)
+
+
+def sample_indices(num_samples, size, seed=0):
+    """Sorted, reproducible random choice of ``size`` sample indices."""
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randperm(num_samples, generator=generator)[:size].sort().values.tolist()
+
+
+def select_samples(dataset, grid, shard):
+    """Restrict ``dataset`` and ``grid`` to ``shard``.
+
+    ``shard`` is ``None`` (everything), a ``(start, end)`` range or a list
+    of sample indices.
+    """
+    if shard is None:
+        return dataset, grid
+    if isinstance(shard, list):
+        index = torch.tensor(shard, dtype=torch.long)
+        return dataset[index], grid.subset(shard) if grid is not None else None
+    start, end = shard
+    return dataset[start:end], grid.slice(start, end) if grid is not None else None
+
+
+# ---------------- MEMORY-MAPPED CACHE ---------------- #
+CACHE_FORMAT = 1
+
+
+def dataset_version(dataset, case_name):
+    """Fingerprint of the processed files backing ``dataset``."""
+    parts = [f"format={CACHE_FORMAT}", f"case={case_name}", f"len={len(dataset)}"]
+    for path in sorted(getattr(dataset, "processed_paths", [])):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}")
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+
+def _cache_dir(root, case_name, version):
+    return os.path.join(root, "grid_cache", case_name, version)
+
+
+def _write_grid(grid, directory):
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    manifest = {"num_samples": grid.num_samples, "fields": {}, "edge_index": {}}
+    arrays = [("fields", name, value) for name, value in grid.fields().items()]
+    arrays += [("edge_index", name, value) for name, value in grid.edge_index.items()]
+    try:
+        for section, name, value in arrays:
+            array = np.ascontiguousarray(value.detach().cpu().numpy())
+            filename = f"{section}.{name}.bin"
+            array.tofile(os.path.join(tmp, filename))
+            manifest[section][name] = {
+                "file": filename,
+                "dtype": str(array.dtype),
+                "shape": list(array.shape),
+            }
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, directory)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.exists(os.path.join(directory, "manifest.json")):
+            raise
+
+
+def _map_array(directory, entry):
+    shape = tuple(entry["shape"])
+    if 0 in shape:
+        return torch.from_numpy(np.empty(shape, dtype=entry["dtype"]))
+    # Copy-on-write mapping: pages are shared through the OS page cache by
+    # every process mapping the same file, and stray writes stay private.
+    array = np.memmap(os.path.join(directory, entry["file"]), dtype=entry["dtype"], mode="c", shape=shape)
+    return torch.from_numpy(array)
+
+
+def _read_grid(directory):
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    fields = {name: _map_array(directory, entry) for name, entry in manifest["fields"].items()}
+    edge_index = {name: _map_array(directory, entry) for name, entry in manifest["edge_index"].items()}
+    return OPFGrid(manifest["num_samples"], fields, edge_index, cache_dir=directory)
+
+
+def load_grid(dataset, case_name, root="data"):
+    """Return the grid view for ``case_name``, building the on-disk cache once."""
+    directory = _cache_dir(root, case_name, dataset_version(dataset, case_name))
+    if not os.path.exists(os.path.join(directory, "manifest.json")):
+        _write_grid(build_grid(dataset), directory)
+    return _read_grid(directory)
+
+
+def open_case(case_name, root="data"):
+    """Load ``case_name`` as ``(dataset, grid)`` with its topology shared.
+
+    Per-sample ``edge_index`` copies are dropped from the dataset's storage
+    and every sample references the single copy instead.
+    """
+    from torch_geometric.datasets import OPFDataset
+
+    from core.topology import share_topology
+
+    dataset = OPFDataset(root=root, case_name=case_name)
+    grid = load_grid(dataset, case_name, root=root)
+    share_topology(dataset)
+    return dataset, grid
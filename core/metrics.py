@@ -0,0 +1,223 @@
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+import torch
+
+# Column positions in the OPFData schema
+RATE_A = {"ac_line": 6, "transformer": 4}
+PT, QT, PF, QF = 0, 1, 2, 3
+PG = 0
+C2, C1, C0 = 8, 9, 10
+VMIN, VMAX = 2, 3
+VM = 1
+PD, QD = 0, 1
+
+# How many entries the cached top-k congestion index keeps per sample
+TOP_K = 10
+
+# Bump whenever a PER_SAMPLE definition (or TOP_K) changes; cached arrays
+# written under another version are recomputed
+METRICS_VERSION = 1
+
+
+def _branch_loading(grid, name):
+    attr = getattr(grid, f"{name}_edge_attr", None)
+    label = getattr(grid, f"{name}_edge_label", None)
+    if attr is None or label is None:
+        return None
+    s_from = torch.hypot(label[..., PF], label[..., QF])
+    s_to = torch.hypot(label[..., PT], label[..., QT])
+    rate = attr[..., RATE_A[name]]
+    loading = torch.maximum(s_from, s_to) / rate.clamp_min(1e-9)
+    return torch.where(rate > 0, loading, torch.zeros_like(loading))
+
+
+def _generator_cost(grid):
+    x, pg = grid.generator_x, grid.generator_y[..., PG]
+    return x[..., C2] * pg**2 + x[..., C1] * pg + x[..., C0]
+
+
+def _voltage_margin(grid):
+    vm = grid.bus_y[..., VM]
+    return torch.minimum(vm - grid.bus_x[..., VMIN], grid.bus_x[..., VMAX] - vm)
+
+
+# name -> (description, builder); every entry is [S, ...] indexed by sample
+PER_SAMPLE = {
+    "line_loading": (
+        "[S, num_ac_lines] max(|S_from|, |S_to|) / rate_a",
+        lambda grid: _branch_loading(grid, "ac_line"),
+    ),
+    "transformer_loading": (
+        "[S, num_transformers] max(|S_from|, |S_to|) / rate_a",
+        lambda grid: _branch_loading(grid, "transformer"),
+    ),
+    "generator_cost": (
+        "[S, num_generators] c2 * pg^2 + c1 * pg + c0",
+        _generator_cost,
+    ),
+    "total_generation_cost": (
+        "[S] sum of generator_cost",
+        lambda grid: _generator_cost(grid).sum(dim=1),
+    ),
+    "total_generation": (
+        "[S] total active generation (sum of pg)",
+        lambda grid: grid.generator_y[..., PG].sum(dim=1),
+    ),
+    "total_load": (
+        "[S] total active load (sum of pd)",
+        lambda grid: grid.load_x[..., PD].sum(dim=1),
+    ),
+    "total_reactive_load": (
+        "[S] total reactive load (sum of qd)",
+        lambda grid: grid.load_x[..., QD].sum(dim=1),
+    ),
+    "voltage_margin_low": (
+        "[S, num_buses] vm - vmin (negative = violation)",
+        lambda grid: grid.bus_y[..., VM] - grid.bus_x[..., VMIN],
+    ),
+    "voltage_margin_high": (
+        "[S, num_buses] vmax - vm (negative = violation)",
+        lambda grid: grid.bus_x[..., VMAX] - grid.bus_y[..., VM],
+    ),
+    "voltage_margin": (
+        "[S, num_buses] min(vm - vmin, vmax - vm)",
+        _voltage_margin,
+    ),
+    "congested_line_loading": (
+        f"[S, {TOP_K}] highest line_loading per sample, descending",
+        lambda grid: _top_lines(grid)[0],
+    ),
+    "congested_line_index": (
+        f"[S, {TOP_K}] AC line indices matching congested_line_loading",
+        lambda grid: _top_lines(grid)[1],
+    ),
+}
+
+
+def _top_lines(grid):
+    loading = _branch_loading(grid, "ac_line")
+    k = min(TOP_K, loading.shape[1])
+    return torch.topk(loading, k, dim=1)
+
+
+def _stats(values):
+    return {
+        "min": values.min(dim=0).values,
+        "max": values.max(dim=0).values,
+        "mean": values.mean(dim=0),
+        "std": values.std(dim=0) if values.shape[0] > 1 else torch.zeros_like(values[0]),
+    }
+
+
+# name -> (description, source tensor) for per-item stats over samples
+ITEM_STATS = {
+    "generator_pg_stats": ("per-generator pg", lambda c: c._windowed(c.grid.generator_y[..., PG])),
+    "generator_cost_stats": ("per-generator cost", lambda c: c.generator_cost),
+    "line_loading_stats": ("per-line loading", lambda c: c.line_loading),
+    "bus_vm_stats": ("per-bus vm", lambda c: c._windowed(c.grid.bus_y[..., VM])),
+}
+
+
+def _write_array(directory, name, value):
+    os.makedirs(directory, exist_ok=True)
+    array = np.ascontiguousarray(value.detach().cpu().numpy())
+    entry = {
+        "file": f"{name}.bin",
+        "dtype": str(array.dtype),
+        "shape": list(array.shape),
+        "version": METRICS_VERSION,
+    }
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        array.tofile(f)
+    os.replace(tmp, os.path.join(directory, entry["file"]))
+    # The sidecar is written last, so its presence marks a complete entry
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp, os.path.join(directory, f"{name}.json"))
+
+
+class MetricCatalog:
+    """Derived OPF quantities, computed on first access and cached on disk.
+
+    Per-sample metrics live next to the grid's memory-mapped cache
+    (``<grid cache>/metrics/<name>.bin``) and are mapped the same way, so
+    later sessions and sandbox workers only pay for a page-in.  A catalog
+    over a sample window (sharded execution) slices the full-case arrays;
+    the ``*_stats`` indexes are then recomputed for the window.
+    """
+
+    def __init__(self, grid, directory=None, window=None):
+        self.grid = grid
+        self.directory = directory
+        self.window = window
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def slice(self, start, end):
+        offset = self.window[0] if self.window is not None else 0
+        view = MetricCatalog(self.grid, self.directory, window=(offset + start, offset + end))
+        view._values, view._lock = self._values, self._lock  # share full-case arrays
+        return view
+
+    def _windowed(self, value):
+        if value is None or self.window is None:
+            return value
+        return value[self.window[0]:self.window[1]]
+
+    def names(self):
+        return list(PER_SAMPLE) + list(ITEM_STATS)
+
+    def _full(self, name):
+        with self._lock:
+            if name in self._values:
+                return self._values[name]
+            value = None
+            if self.directory is not None:
+                value = self._read(name)
+            if value is None:
+                value = PER_SAMPLE[name][1](self.grid)
+                if value is not None and self.directory is not None:
+                    try:
+                        _write_array(self.directory, name, value)
+                    except OSError:
+                        pass  # read-only cache: keep the in-memory value
+            self._values[name] = value
+            return value
+
+    def _read(self, name):
+        from core.grid import _map_array
+
+        sidecar = os.path.join(self.directory, f"{name}.json")
+        if not os.path.exists(sidecar):
+            return None
+        with open(sidecar) as f:
+            entry = json.load(f)
+        if entry.get("version") != METRICS_VERSION:
+            return None  # stale definition: recompute and overwrite
+        return _map_array(self.directory, entry)
+
+    def __getattr__(self, name):
+        if name in PER_SAMPLE:
+            return self._windowed(self._full(name))
+        if name in ITEM_STATS:
+            key = (name, self.window)
+            if key not in self._values:
+                source = ITEM_STATS[name][1](self)
+                self._values[key] = _stats(source) if source is not None else None
+            return self._values[key]
+        raise AttributeError(name)
+
+    def top_congested(self, k=5):
+        """``(loading, line_index)`` of the ``k`` most loaded AC lines per sample."""
+        if k <= TOP_K:
+            return self.congested_line_loading[:, :k], self.congested_line_index[:, :k]
+        return torch.topk(self.line_loading, min(k, self.line_loading.shape[1]), dim=1)
+
+    def __repr__(self):
+        return f"MetricCatalog({', '.join(self.names())})"
@@ -1,16 +1,373 @@
+import copy
+import hashlib
+import queue
+import string
+import time
+import weakref
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from threading import Lock, Thread
+from transformers import (
+    AutoTokenizer,
+    AutoModelForCausalLM,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+    pipeline,
+)
 from langchain_community.llms import HuggingFacePipeline
+from config.profiles import default_profile, load_profiles
 
-def load_model(model_id: str):
-    tokenizer = AutoTokenizer.from_pretrained(model_id)
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model = AutoModelForCausalLM.from_pretrained(
-        model_id,
-        torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-        device_map="auto",
-        attn_implementation="eager",
-        trust_remote_code=True 
+DEFAULT_MAX_NEW_TOKENS = 500
+PREFIX_CACHE_SIZE = 4  # per model: code, fix-up and summary prefixes + slack
+# Longest wait for the next streamed token before giving up on generate
+STREAM_TIMEOUT = 600.0
+
+# model -> (lock, {sha1(prefix text): (prefix token ids, past_key_values)})
+_prefix_caches = weakref.WeakKeyDictionary()
+_prefix_caches_lock = Lock()
+
+# (model_id, profile) -> load time, weight bytes and measured tokens/sec
+profile_stats = {}
+
+def resolve_profile(profile=None):
+    name = profile or default_profile(torch.cuda.is_available())
+    return name, load_profiles[name]
+
+def model_key(model_id: str, profile=None):
+    name, settings = resolve_profile(profile)
+    return (model_id, name, settings["device"])
+
+def load_model(model_id: str, profile=None):
+    name, settings = resolve_profile(profile)
+    if settings["threads"]:
+        torch.set_num_threads(settings["threads"])
+
+    started = time.perf_counter()
+    load_kwargs = dict(
+        torch_dtype=getattr(torch, settings["dtype"]),
+        device_map="auto" if settings["device"] == "cuda" else "cpu",
+        attn_implementation=settings["attn"],
+        trust_remote_code=True,
     )
-    hf_pipeline = pipeline("text-generation", model=model, tokenizer=tokenizer, max_new_tokens=500)
+    if settings["quantization"]:
+        try:
+            from transformers import TorchAoConfig
+            import torchao  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                f"Load profile '{name}' needs torchao for {settings['quantization']} "
+                "quantization: pip install torchao"
+            ) from e
+        quant_kwargs = {}
+        if settings["layout"] == "int4_cpu":
+            from torchao.dtypes import Int4CPULayout
+
+            quant_kwargs["layout"] = Int4CPULayout()
+        load_kwargs["quantization_config"] = TorchAoConfig(settings["quantization"], **quant_kwargs)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForCausalLM.from_pretrained(model_id, **load_kwargs)
+    if settings["compile"]:
+        model.forward = torch.compile(model.forward, dynamic=True)
+    model.profile_key = (model_id, name)
+
+    profile_stats[model.profile_key] = {
+        "load_seconds": round(time.perf_counter() - started, 1),
+        # Weights and buffers only: a process RSS delta would also count
+        # the dataset loading concurrently (see core.startup)
+        "model_bytes": model.get_memory_footprint(),
+        "tokens_per_second": None,
+    }
+    hf_pipeline = pipeline("text-generation", model=model, tokenizer=tokenizer, max_new_tokens=DEFAULT_MAX_NEW_TOKENS)
     return HuggingFacePipeline(pipeline=hf_pipeline)
+
+def _record_throughput(model, new_tokens, decode_seconds):
+    record = profile_stats.get(getattr(model, "profile_key", None))
+    if record is not None and new_tokens and decode_seconds:
+        record["tokens_per_second"] = round(new_tokens / decode_seconds, 2)
+
+
+class StopOnSubstrings(StoppingCriteria):
+    """Stop generation once any of ``stops`` shows up in the decoded tail.
+
+    Also records how many tokens have been generated so far.
+    """
+
+    def __init__(self, tokenizer, stops, prompt_length, window=16):
+        self.tokenizer = tokenizer
+        self.stops = list(stops)
+        self.prompt_length = prompt_length
+        self.window = window
+        self.generated_tokens = 0
+        self.stopped = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        # One flag per sequence so batched/sampled generation stops row-wise
+        generated = input_ids[:, self.prompt_length:]
+        self.generated_tokens = generated.shape[1]
+        if not self.stops:
+            return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        tails = self.tokenizer.batch_decode(generated[:, -self.window:], skip_special_tokens=True)
+        done = torch.tensor(
+            [any(stop in tail for stop in self.stops) for tail in tails],
+            dtype=torch.bool, device=input_ids.device,
+        )
+        self.stopped = bool(done.all())
+        return done
+
+
+def template_prefix(prompt) -> str:
+    """Formatted text of ``prompt`` before its first input variable."""
+    literal = []
+    for text, field, _, _ in string.Formatter().parse(prompt.template):
+        literal.append(text)
+        if field is not None:
+            break
+    return "".join(literal)
+
+
+def prefix_kv(model, tokenizer, prefix: str):
+    """Past key/values for ``prefix``, computed once per model and text.
+
+    Keyed by a hash of the text itself, so editing a template simply misses
+    and the stale entry ages out.  Sessions share the model, so each
+    model's cache is guarded by its own lock; a prefix being computed is
+    waited for rather than computed twice.
+    """
+    with _prefix_caches_lock:
+        lock, caches = _prefix_caches.setdefault(model, (Lock(), {}))
+    key = hashlib.sha1(prefix.encode()).hexdigest()
+    with lock:
+        if key in caches:
+            caches[key] = caches.pop(key)  # most recently used last
+            return caches[key]
+
+        ids = tokenizer(prefix, return_tensors="pt").input_ids.to(model.device)
+        with torch.no_grad():
+            output = model(ids, use_cache=True)
+        caches[key] = entry = (ids[0], output.past_key_values)
+        while len(caches) > PREFIX_CACHE_SIZE:
+            caches.pop(next(iter(caches)))
+        return entry
+
+
+def _reusable_prefix(model, tokenizer, prefix, input_ids):
+    """Copy of the cached prefix KV matching ``input_ids``, and its length."""
+    prefix_ids, prefix_cache = prefix_kv(model, tokenizer, prefix)
+    full = input_ids[0]
+    n = min(prefix_ids.shape[0], full.shape[0] - 1)  # leave a token to prefill
+    if n <= 0:
+        return None, 0
+    matches = (prefix_ids[:n] == full[:n]).int().cumprod(dim=0)
+    length = int(matches.sum())
+    if length == 0:
+        return None, 0
+    cache = copy.deepcopy(prefix_cache)
+    if length < prefix_ids.shape[0]:
+        if not hasattr(cache, "crop"):
+            return None, 0
+        cache.crop(length)  # tokenization differs at the prefix boundary
+    return cache, length
+
+
+def stream_chain(chain, inputs: dict, stop=(), max_new_tokens=None, stats=None, prefix=None):
+    """Yield generated text chunks for ``chain`` as soon as they are decoded.
+
+    Falls back to a single blocking ``chain.invoke`` chunk for LLMs that are
+    not backed by a local HuggingFace pipeline.  If ``stats`` is given it is
+    filled with the token budget, tokens generated, tokens saved by stopping
+    early, prefix tokens reused and prefill/decode timings.
+
+    Chains wrapped in a :class:`core.scheduler.ScheduledChain` are queued
+    and micro-batched with other requests instead, and yield one chunk.
+
+    The key/values of the static ``prefix`` (by default the template text
+    before its first variable) are computed once and reused, so only the
+    query part of the prompt is prefilled.
+    """
+    budget = max_new_tokens or DEFAULT_MAX_NEW_TOKENS
+    if stats is not None:
+        stats.update(
+            max_new_tokens=budget, new_tokens=None, saved_tokens=None, stopped_early=False,
+            prefix_tokens_reused=0, prefill_seconds=None, decode_seconds=None,
+        )
+
+    scheduler = getattr(chain, "scheduler", None)
+    if scheduler is not None:
+        # Batched with other sessions' requests: arrives in one piece
+        reply = scheduler.submit(chain.prompt.format(**inputs), stop, budget).result()
+        if stats is not None:
+            stats.update(
+                new_tokens=reply["new_tokens"],
+                saved_tokens=budget - reply["new_tokens"],
+                stopped_early=reply["new_tokens"] < budget,
+                queue_seconds=reply["queue_seconds"],
+                batch_size=reply["batch_size"],
+            )
+        yield reply["text"]
+        return
+
+    hf_pipeline = getattr(chain.llm, "pipeline", None)
+    if hf_pipeline is None:
+        output = chain.invoke(inputs)
+        yield output.get("text", "") if isinstance(output, dict) else str(output)
+        return
+
+    tokenizer, model = hf_pipeline.tokenizer, hf_pipeline.model
+    prompt = chain.prompt.format(**inputs)
+    encoded = tokenizer(prompt, return_tensors="pt").to(model.device)
+    streamer = TextIteratorStreamer(
+        tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=STREAM_TIMEOUT
+    )
+
+    criteria = StopOnSubstrings(tokenizer, stop, encoded["input_ids"].shape[1])
+    generate_kwargs = dict(
+        **encoded,
+        streamer=streamer,
+        max_new_tokens=budget,
+        stopping_criteria=StoppingCriteriaList([criteria]),
+        pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
+    )
+
+    started = time.perf_counter()
+    prefix = template_prefix(chain.prompt) if prefix is None else prefix
+    reused = 0
+    if prefix:
+        cache, reused = _reusable_prefix(model, tokenizer, prefix, encoded["input_ids"])
+        if cache is not None:
+            generate_kwargs["past_key_values"] = cache
+
+    failure = []
+
+    def generate():
+        # An exception in generate must still end the stream, or the
+        # loop below would wait for tokens that never come
+        try:
+            model.generate(**generate_kwargs)
+        except Exception as e:
+            failure.append(e)
+            streamer.end()
+
+    thread = Thread(target=generate, daemon=True)
+    thread.start()
+    first_token_at = None
+    try:
+        for chunk in streamer:
+            if chunk:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                yield chunk
+    except queue.Empty:
+        raise TimeoutError(f"No token generated for {STREAM_TIMEOUT:.0f}s") from None
+    thread.join()
+    if failure:
+        raise failure[0]
+    finished = time.perf_counter()
+
+    if stats is not None:
+        first_token_at = first_token_at or finished
+        stats.update(
+            new_tokens=criteria.generated_tokens,
+            saved_tokens=budget - criteria.generated_tokens,
+            stopped_early=criteria.stopped,
+            prefix_tokens_reused=reused,
+            prefill_seconds=round(first_token_at - started, 3),
+            decode_seconds=round(finished - first_token_at, 3),
+        )
+    _record_throughput(model, criteria.generated_tokens, finished - first_token_at if first_token_at else 0)
+
+
+def generate_candidates(chain, inputs: dict, n: int, stop=(), max_new_tokens=None,
+                        temperature=0.7, top_p=0.95):
+    """Sample ``n`` completions for ``chain`` in a single batched generate call."""
+    hf_pipeline = getattr(chain.llm, "pipeline", None)
+    if hf_pipeline is None:
+        outputs = [chain.invoke(inputs) for _ in range(n)]
+        return [o.get("text", "") if isinstance(o, dict) else str(o) for o in outputs]
+
+    tokenizer, model = hf_pipeline.tokenizer, hf_pipeline.model
+    encoded = tokenizer(chain.prompt.format(**inputs), return_tensors="pt").to(model.device)
+    prompt_length = encoded["input_ids"].shape[1]
+    output = model.generate(
+        **encoded,
+        do_sample=True,
+        temperature=temperature,
+        top_p=top_p,
+        num_return_sequences=n,
+        max_new_tokens=max_new_tokens or DEFAULT_MAX_NEW_TOKENS,
+        stopping_criteria=StoppingCriteriaList([StopOnSubstrings(tokenizer, stop, prompt_length)]),
+        pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
+    )
+    return tokenizer.batch_decode(output[:, prompt_length:], skip_special_tokens=True)
+
+
+class _RowStops(StoppingCriteria):
+    """Per-row stop strings and token budgets for a mixed batch."""
+
+    def __init__(self, tokenizer, requests, prompt_length, window=16):
+        self.tokenizer = tokenizer
+        self.requests = requests
+        self.prompt_length = prompt_length
+        self.window = window
+        self.done = [False] * len(requests)
+        self.lengths = [0] * len(requests)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids[:, self.prompt_length:]
+        tails = self.tokenizer.batch_decode(generated[:, -self.window:], skip_special_tokens=True)
+        for i, (request, tail) in enumerate(zip(self.requests, tails)):
+            if self.done[i]:
+                continue
+            self.lengths[i] = generated.shape[1]
+            if generated.shape[1] >= request["max_new_tokens"] or any(s in tail for s in request["stop"]):
+                self.done[i] = True
+        return torch.tensor(self.done, dtype=torch.bool, device=input_ids.device)
+
+
+def generate_batch(model, tokenizer, requests):
+    """Greedy generation for several prompts in one left-padded batch.
+
+    ``requests`` are dicts with ``prompt``, ``stop`` and ``max_new_tokens``;
+    returns one ``{"text", "new_tokens"}`` per request, cut after its stop.
+    """
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    encoded = tokenizer([r["prompt"] for r in requests], return_tensors="pt", padding=True).to(model.device)
+    prompt_length = encoded["input_ids"].shape[1]
+    criteria = _RowStops(tokenizer, requests, prompt_length)
+    with torch.no_grad():
+        output = model.generate(
+            **encoded,
+            max_new_tokens=max(r["max_new_tokens"] for r in requests),
+            stopping_criteria=StoppingCriteriaList([criteria]),
+            pad_token_id=tokenizer.pad_token_id,
+        )
+    texts = tokenizer.batch_decode(output[:, prompt_length:], skip_special_tokens=True)
+
+    replies = []
+    for request, text, length in zip(requests, texts, criteria.lengths):
+        for stop in request["stop"]:
+            if stop in text:
+                text = text[:text.index(stop) + len(stop)]
+        replies.append({"text": text, "new_tokens": length})
+    return replies
+
+
+def generate_chain_batch(chain, inputs_list, stop=(), max_new_tokens=None, batch_size=4):
+    """Run ``chain`` over many inputs, ``batch_size`` prompts per generate call."""
+    hf_pipeline = getattr(chain.llm, "pipeline", None)
+    if hf_pipeline is None:
+        outputs = [chain.invoke(inputs) for inputs in inputs_list]
+        return [o.get("text", "") if isinstance(o, dict) else str(o) for o in outputs]
+
+    requests = [
+        {"prompt": chain.prompt.format(**inputs), "stop": list(stop),
+         "max_new_tokens": max_new_tokens or DEFAULT_MAX_NEW_TOKENS}
+        for inputs in inputs_list
+    ]
+    texts = []
+    for start in range(0, len(requests), batch_size):
+        batch = requests[start:start + batch_size]
+        texts += [reply["text"] for reply in generate_batch(hf_pipeline.model, hf_pipeline.tokenizer, batch)]
+    return texts
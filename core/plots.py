@@ -0,0 +1,165 @@
+import hashlib
+import io
+import itertools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Artists with more points than this are aggregated before drawing
+MAX_POINTS = 20_000
+# Output resolution is capped so image size does not grow with the figure
+DPI = 100
+MAX_INCHES = 16
+
+
+class ImageCache:
+    """Process-wide LRU of rendered images keyed by :func:`figure_key`."""
+
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            image = self._entries.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key, image):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = image
+            self._bytes += len(image)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= len(old)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+images = ImageCache()
+
+
+def _minmax_decimate(x, y, buckets):
+    """Keep the min and max of ``y`` in each of ``buckets`` index ranges."""
+    edges = np.linspace(0, len(y), buckets + 1, dtype=int)
+    keep = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end <= start:
+            continue
+        chunk = y[start:end]
+        finite = np.isfinite(chunk)
+        if not finite.any():
+            continue
+        lo, hi = start + int(np.nanargmin(chunk)), start + int(np.nanargmax(chunk))
+        keep.extend(sorted({lo, hi}))
+    keep = np.asarray(keep, dtype=int)
+    return x[keep], y[keep]
+
+
+def aggregate_figure(fig, max_points=MAX_POINTS):
+    """Bound the number of drawn points in ``fig``; returns how many were aggregated.
+
+    Long lines are min-max decimated (peaks are preserved) and large
+    scatters are replaced by a hexbin density on the same axes.  Artists
+    whose data cannot be read as floats are left alone.
+    """
+    from matplotlib.collections import PathCollection
+
+    aggregated = 0
+    for ax in fig.axes:
+        for line in ax.get_lines():
+            if len(line.get_xdata(orig=False)) <= max_points:
+                continue
+            try:
+                # Unit-converted, so categorical and datetime axes work too
+                xy = np.asarray(line.get_xydata(), dtype=float)
+            except (TypeError, ValueError):
+                continue
+            line.set_data(*_minmax_decimate(xy[:, 0], xy[:, 1], max_points // 2))
+            aggregated += len(xy)
+        for collection in list(ax.collections):
+            if not isinstance(collection, PathCollection) or len(collection.get_offsets()) <= max_points:
+                continue
+            try:
+                offsets = np.asarray(collection.get_offsets(), dtype=float)
+            except (TypeError, ValueError):
+                continue
+            label = collection.get_label()
+            collection.remove()
+            ax.hexbin(offsets[:, 0], offsets[:, 1], gridsize=120, mincnt=1, bins="log",
+                      cmap="viridis", label=None if label.startswith("_") else label)
+            aggregated += len(offsets)
+    if aggregated:
+        fig.text(0.99, 0.01, f"{aggregated:,} points aggregated", ha="right", va="bottom",
+                 fontsize=7, alpha=0.6)
+    return aggregated
+
+
+def figure_key(source, index, fmt):
+    """Image cache key of figure ``index`` produced by ``source``.
+
+    ``source`` identifies what produced the result, e.g. the code's AST
+    hash plus the dataset fingerprint and sample selection.
+    """
+    return hashlib.sha1(f"{source}|{index}|{fmt}".encode()).hexdigest()
+
+
+def render_figure(fig, fmt="png", key=None, cache=images):
+    """Aggregate, render and close ``fig``; a cached image for ``key`` skips all that."""
+    import matplotlib.pyplot as plt
+
+    try:
+        image = cache.get(key) if key is not None and cache is not None else None
+        if image is not None:
+            return image
+        aggregate_figure(fig)
+        width, height = fig.get_size_inches()
+        scale = min(1.0, MAX_INCHES / max(width, height, 1e-9))
+        if scale < 1.0:
+            fig.set_size_inches(width * scale, height * scale)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, dpi=DPI, bbox_inches="tight")
+        image = buffer.getvalue()
+        if key is not None and cache is not None:
+            cache.put(key, image)
+        return image
+    finally:
+        plt.close(fig)
+
+
+def render_figures(result, fmt="png", source=None):
+    """Replace matplotlib figures in ``result`` by image bytes and close them.
+
+    With ``source`` (see :func:`figure_key`) images are cached, so the same
+    code on the same data is only rendered once.
+    """
+    from matplotlib.figure import Figure
+
+    counter = itertools.count()
+
+    def render(value):
+        if isinstance(value, Figure):
+            index = next(counter)
+            key = figure_key(source, index, fmt) if source is not None else None
+            return render_figure(value, fmt, key)
+        if isinstance(value, list):
+            return [render(v) for v in value]
+        return value
+
+    for key in ("plot", "plots"):
+        if key in result:
+            result[key] = render(result[key])
+    return result
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+EMBEDDING_DIM = 512
+
+
+def normalize_query(query: str) -> str:
+    query = query.lower().strip()
+    query = re.sub(r"[^\w\s]", " ", query)
+    return re.sub(r"\s+", " ", query).strip()
+
+
+# Words that change what is computed; fuzzy matches must agree on them
+CANONICAL_TOKENS = {
+    "bus": "bus", "buses": "bus",
+    "generator": "generator", "generators": "generator", "gen": "generator",
+    "line": "line", "lines": "line", "branch": "line", "branches": "line",
+    "load": "load", "loads": "load",
+    "shunt": "shunt", "shunts": "shunt",
+    "transformer": "transformer", "transformers": "transformer",
+    "active": "active", "reactive": "reactive",
+    "angle": "angle", "magnitude": "magnitude", "voltage": "voltage",
+    "cost": "cost", "loading": "loading",
+    "mean": "mean", "average": "mean", "avg": "mean",
+    "min": "min", "minimum": "min", "lowest": "min", "smallest": "min",
+    "max": "max", "maximum": "max", "highest": "max", "largest": "max",
+    "sum": "sum", "total": "sum",
+    "std": "std", "median": "median", "count": "count",
+    "above": "above", "below": "below",
+}
+
+
+def key_tokens(normalized: str) -> list:
+    """Numbers and entity/statistic words of a normalized query, as a sorted multiset."""
+    tokens = []
+    for word in normalized.split():
+        if any(ch.isdigit() for ch in word):
+            tokens.append(word)
+        elif word in CANONICAL_TOKENS:
+            tokens.append(CANONICAL_TOKENS[word])
+    return sorted(tokens)
+
+
+def hashed_embedding(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Cheap bag of words + character trigrams, hashed into ``dim`` buckets.
+
+    Good enough to match rephrasings of the same short question without
+    pulling in a sentence-embedding model next to the code LLM.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    words = normalize_query(text).split()
+    features = list(words)
+    for word in words:
+        padded = f"#{word}#"
+        features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    for feature in features:
+        digest = hashlib.md5(feature.encode()).digest()
+        vector[int.from_bytes(digest[:4], "little") % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def prompt_fingerprint(*templates: str) -> str:
+    return hashlib.sha1("\x00".join(templates).encode()).hexdigest()[:12]
+
+
+class QueryCache:
+    """Persistent map from a normalized query to the last code that worked.
+
+    Entries are scoped by case name and prompt fingerprint, so editing the
+    prompts or switching dataset never serves stale code.  Lookups try an
+    exact match first and then the nearest embedding above ``threshold``
+    among entries with the same :func:`key_tokens`, so "generator 3" never
+    reuses the code for "generator 5".
+    """
+
+    def __init__(self, path="data/query_cache.sqlite", max_entries=500,
+                 threshold=0.9, embed_fn=hashed_embedding):
+        self.path = path
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.embed_fn = embed_fn
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                    case_name TEXT, fingerprint TEXT, normalized TEXT,
+                    query TEXT, code TEXT, embedding BLOB,
+                    hits INTEGER DEFAULT 0, last_used REAL,
+                    PRIMARY KEY (case_name, fingerprint, normalized))"""
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, query, case_name, fingerprint):
+        """Return ``(code, similarity)`` for a cached query, or ``None``."""
+        normalized = normalize_query(query)
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT normalized, code, embedding FROM entries WHERE case_name=? AND fingerprint=?",
+                (case_name, fingerprint),
+            ).fetchall()
+
+            best, best_score = None, 0.0
+            for row_normalized, code, blob in rows:
+                if row_normalized == normalized:
+                    best, best_score = (row_normalized, code), 1.0
+                    break
+            if best is None and rows:
+                embedding = self.embed_fn(query)
+                tokens = key_tokens(normalized)
+                for row_normalized, code, blob in rows:
+                    if key_tokens(row_normalized) != tokens:
+                        continue
+                    score = float(np.dot(embedding, np.frombuffer(blob, dtype=np.float32)))
+                    if score > best_score:
+                        best, best_score = (row_normalized, code), score
+
+            if best is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+
+            conn.execute(
+                "UPDATE entries SET hits=hits+1, last_used=? WHERE case_name=? AND fingerprint=? AND normalized=?",
+                (time.time(), case_name, fingerprint, best[0]),
+            )
+            self.hits += 1
+            return best[1], best_score
+
+    def put(self, query, case_name, fingerprint, code):
+        embedding = self.embed_fn(query).astype(np.float32).tobytes()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                """INSERT INTO entries (case_name, fingerprint, normalized, query, code, embedding, last_used)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (case_name, fingerprint, normalized)
+                   DO UPDATE SET code=excluded.code, query=excluded.query, last_used=excluded.last_used""",
+                (case_name, fingerprint, normalize_query(query), query, code, embedding, time.time()),
+            )
+            conn.execute(
+                """DELETE FROM entries WHERE rowid IN (
+                       SELECT rowid FROM entries ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+                (self.max_entries,),
+            )
+
+    def stats(self):
+        with self._lock, self._connect() as conn:
+            (entries,) = conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_cache(path="data/query_cache.sqlite"):
+    """One ``QueryCache`` per path for the whole process (keeps counters)."""
+    with _shared_lock:
+        if path not in _shared:
+            _shared[path] = QueryCache(path)
+        return _shared[path]
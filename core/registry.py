@@ -0,0 +1,155 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+
+class ResourceRegistry:
+    """Process-wide, reference-counted LRU cache for heavy objects.
+
+    Streamlit reruns the script per session, but module state lives for the
+    whole server process, so every browser tab can share one loaded model
+    and one dataset.  Entries that nobody holds are evicted oldest-first once
+    ``max_entries`` is exceeded, together with anything attached to them.
+    """
+
+    def __init__(self, max_entries=2):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._loading = {}
+
+    def acquire(self, key, loader, size_fn=None):
+        """Return the object for ``key``, loading it once; bumps its refcount."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                event = self._loading.get(key)
+                owner = event is None
+                if owner:
+                    event = self._loading[key] = threading.Event()
+            else:
+                owner = False
+                event = None
+
+        if entry is None and not owner:
+            # Another session is loading the same key; wait and retry.
+            event.wait()
+            return self.acquire(key, loader, size_fn)
+
+        if entry is None:
+            try:
+                started = time.perf_counter()
+                value = loader()
+                entry = {
+                    "value": value,
+                    "refs": 0,
+                    "bytes": size_fn(value) if size_fn else 0,
+                    "load_seconds": time.perf_counter() - started,
+                }
+                with self._lock:
+                    self._entries[key] = entry
+            finally:
+                with self._lock:
+                    self._loading.pop(key).set()
+
+        with self._lock:
+            entry["refs"] += 1
+            self._entries.move_to_end(key)
+            self._evict()
+            return entry["value"]
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["refs"] > 0:
+                entry["refs"] -= 1
+            self._evict()
+
+    def attach(self, key, name, factory):
+        """Return the helper ``name`` of the resident ``key``, building it once.
+
+        Attached objects live exactly as long as the entry: when it is
+        evicted their ``close()`` is called.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                raise KeyError(f"{key!r} is not loaded")
+            attached = entry.setdefault("attached", {})
+            if name not in attached:
+                attached[name] = factory()
+            return attached[name]
+
+    def _evict(self):
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_entries:
+                break
+            if self._entries[key]["refs"] == 0:
+                entry = self._entries.pop(key)
+                for helper in entry.get("attached", {}).values():
+                    close = getattr(helper, "close", None)
+                    if close is not None:
+                        close()
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {
+                    "key": key,
+                    "refs": entry["refs"],
+                    "bytes": entry["bytes"],
+                    "load_seconds": round(entry["load_seconds"], 2),
+                }
+                for key, entry in self._entries.items()
+            ]
+
+
+def _release_all(held):
+    while held:
+        registry, key = held.pop()
+        registry.release(key)
+
+
+class Lease:
+    """Registry references owned by one session.
+
+    Whatever the lease still holds is released when it is garbage
+    collected, so a browser session that goes away without unloading does
+    not pin its model and dataset forever.
+    """
+
+    def __init__(self):
+        self._held = []
+        self._lock = threading.Lock()
+        weakref.finalize(self, _release_all, self._held)
+
+    def hold(self, registry, key):
+        """Take over a reference already acquired from ``registry``."""
+        with self._lock:
+            self._held.append((registry, key))
+
+    def release(self, registry, key):
+        with self._lock:
+            if (registry, key) not in self._held:
+                return
+            self._held.remove((registry, key))
+        registry.release(key)
+
+
+def tensor_bytes(obj):
+    """Best-effort resident size of a model, pipeline or grid view."""
+    import torch
+
+    model = getattr(getattr(obj, "pipeline", None), "model", None)
+    if model is not None:
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    if hasattr(obj, "fields"):
+        return sum(t.numel() * t.element_size() for t in obj.fields().values())
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    return 0
+
+
+models = ResourceRegistry(max_entries=1)
+datasets = ResourceRegistry(max_entries=2)
@@ -0,0 +1,118 @@
+import ast
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+
+
+def code_hash(code: str) -> str:
+    """Hash of the code's AST, so formatting and comments do not matter."""
+    try:
+        normalized = ast.dump(ast.parse(code), annotate_fields=False)
+    except SyntaxError:
+        normalized = code.strip()
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+class ResultCache:
+    """On-disk memo of executed code: result dict, figures and summary.
+
+    Keyed by (code AST hash, case name, dataset fingerprint), so a rebuilt
+    dataset under ``data/`` gets a new fingerprint and never sees old
+    results.  Total size is capped at ``max_bytes``; least recently used
+    entries are dropped first.
+    """
+
+    def __init__(self, root="data/result_cache", max_bytes=512 * 2**20):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, code, case_name, dataset_fingerprint):
+        raw = f"{code_hash(code)}|{case_name}|{dataset_fingerprint}"
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get(self, key):
+        directory = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(directory, "result.pkl"), "rb") as f:
+                result = pickle.load(f)
+            with open(os.path.join(directory, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(os.path.join(directory, "meta.json"))
+        self.hits += 1
+        return {"result": result, "summary": meta["summary"]}
+
+    def put(self, key, result, summary):
+        try:
+            payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return False  # e.g. an unpicklable object in the result
+
+        tmp = tempfile.mkdtemp(dir=self.root, prefix=".tmp-")
+        try:
+            with open(os.path.join(tmp, "result.pkl"), "wb") as f:
+                f.write(payload)
+            with open(os.path.join(tmp, "meta.json"), "w") as f:
+                json.dump({"summary": summary, "created": time.time(), "bytes": len(payload)}, f)
+            directory = os.path.join(self.root, key)
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(tmp, directory)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return False
+        self._evict()
+        return True
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.root):
+            meta = os.path.join(self.root, name, "meta.json")
+            if name.startswith(".") or not os.path.exists(meta):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(self.root, name, f))
+                for f in os.listdir(os.path.join(self.root, name))
+            )
+            entries.append((os.path.getmtime(meta), size, name))
+        return sorted(entries)
+
+    def _evict(self):
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                total -= size
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_result_cache(root="data/result_cache"):
+    with _shared_lock:
+        if root not in _shared:
+            _shared[root] = ResultCache(root)
+        return _shared[root]
@@ -0,0 +1,272 @@
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class SandboxError(RuntimeError):
+    """Generated code failed, timed out or was killed inside a worker."""
+
+
+def _worker_main(conn, case_name, root):
+    # Pay every heavy import and the dataset mapping once, before the first job
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+    import torch
+    from core.grid import dataset_version, open_case, select_samples
+    from core.result_cache import code_hash
+    from core.tracing import CountingDataset
+    from core.plots import render_figures
+
+    dataset, grid = open_case(case_name, root=root)
+    topology = grid.topology  # built once; shard views share it
+    version = dataset_version(dataset, case_name)
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        code, shard = job
+        try:
+            scoped_dataset, scoped_grid = select_samples(dataset, grid, shard)
+            counted = CountingDataset(scoped_dataset)
+            exec_scope = {
+                "dataset": counted,
+                "grid": scoped_grid,
+                "topology": topology,
+                "metrics": scoped_grid.metrics,
+                "result": {},
+                "torch": torch,
+            }
+            exec(code, exec_scope)
+            source = f"{code_hash(code)}|{case_name}|{version}|{shard}"
+            result = render_figures(exec_scope.get("result", {}), source=source)
+            matplotlib.pyplot.close("all")  # figures not stored in result
+            conn.send(("ok", (result, counted.samples_touched)))
+        except Exception as e:
+            conn.send(("error", (str(e), traceback.format_exc())))
+
+
+class _AnyEvent:
+    """Read-only view that is set as soon as any of ``events`` is."""
+
+    def __init__(self, *events):
+        self.events = [e for e in events if e is not None]
+
+    def is_set(self):
+        return any(e.is_set() for e in self.events)
+
+
+def _rss_bytes(pid, field="VmRSS"):
+    # RssAnon is the private part: it excludes the shared memory-mapped grid
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class _Worker:
+    def __init__(self, ctx, case_name, root):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child, case_name, root), name=f"opf-sandbox-{case_name}", daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.ready = False
+
+    def wait_ready(self, timeout=None):
+        if not self.ready:
+            if not self.conn.poll(timeout):
+                raise SandboxError("Sandbox worker did not start in time")
+            try:
+                status, _ = self.conn.recv()
+            except (EOFError, OSError):
+                self.process.join(timeout=5)
+                raise SandboxError(
+                    f"Sandbox worker exited during startup (exit code {self.process.exitcode})"
+                )
+            self.ready = status == "ready"
+        return self.ready
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class SandboxPool:
+    """Pre-warmed worker processes that execute generated code in isolation.
+
+    Each worker has torch and matplotlib imported and the case's dataset and
+    memory-mapped grid loaded before it takes a job.  A job that exceeds the
+    wall-clock ``timeout`` or the ``max_rss_bytes`` limit, or that is
+    cancelled, has its worker killed and replaced; the server process only
+    ever sees the pickled result dict with figures rendered to PNG bytes.
+
+    Memory trade-off: only the grid is memory-mapped and shared through the
+    page cache.  Each worker loads its own in-RAM ``OPFDataset``, so a case
+    costs ``size`` dataset copies on top of the server's, plus one more
+    while a killed worker's replacement starts.  :meth:`snapshot` reports
+    the workers' private memory.
+    """
+
+    def __init__(self, case_name, root="data", size=2, timeout=120.0,
+                 max_rss_bytes=8 * 2**30, startup_timeout=600.0):
+        self.case_name = case_name
+        self.root = root
+        self.size = size
+        self.timeout = timeout
+        self.max_rss_bytes = max_rss_bytes
+        self.startup_timeout = startup_timeout
+        self._ctx = mp.get_context("spawn")
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        return _Worker(self._ctx, self.case_name, self.root)
+
+    def run(self, code, timeout=None, cancel_event=None, shard=None, stats=None):
+        """Execute ``code`` in a worker and return its ``result`` dict.
+
+        ``shard=(start, end)`` or a list of sample indices restricts
+        ``dataset`` and ``grid`` to those samples.  ``stats`` receives the number of samples the code read.
+        Setting ``cancel_event`` kills this job's worker only; other callers'
+        jobs on the same pool are unaffected.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        worker = self._idle.get()
+        if cancel_event is not None and cancel_event.is_set():
+            self._idle.put(worker)
+            raise SandboxError("Execution cancelled")
+        healthy = False
+        try:
+            worker.wait_ready(self.startup_timeout)
+            try:
+                worker.conn.send((code, shard))
+            except OSError:  # worker died while idle
+                raise self._died(worker)
+            deadline = time.monotonic() + timeout
+            while not worker.conn.poll(0.1):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise SandboxError("Execution cancelled")
+                if time.monotonic() > deadline:
+                    raise SandboxError(f"Execution timed out after {timeout:.0f}s")
+                if self.max_rss_bytes and _rss_bytes(worker.process.pid) > self.max_rss_bytes:
+                    raise SandboxError(
+                        f"Execution exceeded the memory limit of {self.max_rss_bytes / 2**30:.1f} GiB"
+                    )
+                if not worker.process.is_alive():
+                    raise self._died(worker)
+            try:
+                status, payload = worker.conn.recv()
+            except EOFError:
+                raise self._died(worker)
+            healthy = True
+        finally:
+            if healthy:
+                self._idle.put(worker)
+            else:
+                worker.kill()
+                self._idle.put(self._spawn())
+
+        if status == "error":
+            message, _ = payload
+            raise SandboxError(message)
+        result, samples_touched = payload
+        if stats is not None:
+            stats["samples_touched"] = stats.get("samples_touched", 0) + samples_touched
+        return result
+
+    def race(self, codes, accept=None, cancel_event=None):
+        """Run ``codes`` concurrently and keep the first acceptable result.
+
+        Returns ``(index, result, finished)`` where ``finished`` counts the
+        candidates that completed up to and including the winner, or
+        ``(None, errors, finished)`` if none succeeded; any exception a
+        candidate raises is recorded as its error.  Remaining jobs are
+        cancelled as soon as a winner is found.  Cancelling is not free:
+        every loser that was still running has its worker killed and
+        respawned, and the new worker reloads the whole case, so a race
+        over ``n`` codes can cost up to ``min(n, size) - 1`` reloads.
+        Setting ``cancel_event`` stops every candidate.
+        """
+        cancel = threading.Event()
+        stop = _AnyEvent(cancel, cancel_event)
+        errors = {}
+        finished = 0
+        with ThreadPoolExecutor(max_workers=len(codes)) as threads:
+            futures = {
+                threads.submit(self.run, code, cancel_event=stop): i
+                for i, code in enumerate(codes)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                finished += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors[index] = e
+                    continue
+                if accept is None or accept(result):
+                    cancel.set()
+                    return index, result, finished
+                errors[index] = SandboxError("Result failed the shape check")
+        return None, errors, finished
+
+    def snapshot(self):
+        """Live workers and their private (non-shared) memory in bytes."""
+        workers = [
+            p for p in mp.active_children() if p.name == f"opf-sandbox-{self.case_name}"
+        ]
+        return {
+            "case": self.case_name,
+            "workers": len(workers),
+            "private_bytes": sum(_rss_bytes(p.pid, "RssAnon") for p in workers),
+        }
+
+    def _died(self, worker):
+        return SandboxError(f"Sandbox worker crashed (exit code {worker.process.exitcode})")
+
+    def shutdown(self):
+        while not self._idle.empty():
+            worker = self._idle.get_nowait()
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.kill()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pools_snapshot():
+    """:meth:`SandboxPool.snapshot` of every shared pool."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.snapshot() for pool in pools]
+
+
+def shared_pool(case_name, root="data", size=None):
+    """One pre-warmed pool per case for the whole process."""
+    with _pools_lock:
+        if case_name not in _pools:
+            size = size or int(os.environ.get("OPF_SANDBOX_WORKERS", "2"))
+            _pools[case_name] = SandboxPool(case_name, root=root, size=size)
+        return _pools[case_name]
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+
+from core.model import generate_batch
+
+
+class BatchScheduler:
+    """Single model-serving worker with an asyncio queue in front of it.
+
+    Prompts submitted from any session or thread are grouped into padded
+    batches: the worker takes the first waiting request, then keeps
+    collecting for up to ``max_wait`` seconds or ``max_batch`` requests.
+    Code and summary prompts can share a batch since stops and budgets are
+    tracked per row.  Each caller gets a future resolving to its own text
+    plus its queue time and batch size.  :meth:`close` stops the worker.
+    """
+
+    def __init__(self, llm, max_batch=4, max_wait=0.05):
+        hf_pipeline = llm.pipeline
+        self.model = hf_pipeline.model
+        self.tokenizer = hf_pipeline.tokenizer
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._loop = asyncio.new_event_loop()
+        self._queue = None
+        self._task = None
+        self._closed = False
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _serve(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        self._task = self._loop.create_task(self._worker())
+        self._ready.set()
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # Requests still waiting are cancelled so their callers do not hang
+            pending = asyncio.all_tasks(self._loop)
+            for task in pending:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self._loop.close()
+
+    def close(self):
+        """Stop the worker thread; queued requests raise ``CancelledError``."""
+        if not self._closed:
+            self._closed = True
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+    def submit(self, prompt, stop=(), max_new_tokens=500):
+        """Queue ``prompt``; returns a ``concurrent.futures.Future``."""
+        if self._closed:
+            raise RuntimeError("BatchScheduler is closed")
+        request = {
+            "prompt": prompt,
+            "stop": list(stop),
+            "max_new_tokens": max_new_tokens,
+            "submitted": time.perf_counter(),
+        }
+        return asyncio.run_coroutine_threadsafe(self._enqueue(request), self._loop)
+
+    async def _enqueue(self, request):
+        request["future"] = self._loop.create_future()
+        await self._queue.put(request)
+        return await request["future"]
+
+    async def _worker(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - self._loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            started = time.perf_counter()
+            try:
+                replies = await asyncio.to_thread(self._generate, batch)
+            except Exception as e:
+                for request in batch:
+                    request["future"].set_exception(e)
+                continue
+            for request, reply in zip(batch, replies):
+                reply.update(queue_seconds=round(started - request["submitted"], 3), batch_size=len(batch))
+                request["future"].set_result(reply)
+
+    def _generate(self, batch):
+        return generate_batch(self.model, self.tokenizer, batch)
+
+
+class ScheduledChain:
+    """Drop-in for an ``LLMChain`` whose generations go through a scheduler."""
+
+    def __init__(self, chain, scheduler):
+        self.chain = chain
+        self.prompt = chain.prompt
+        self.llm = chain.llm
+        self.scheduler = scheduler
+
+    def invoke(self, inputs):
+        reply = self.scheduler.submit(self.prompt.format(**inputs)).result()
+        return {"text": reply["text"]}
+
+
+def shared_scheduler(key, llm, **options):
+    """One scheduler per loaded model, stopped when the model is evicted."""
+    from core import registry
+
+    return registry.models.attach(key, "scheduler", lambda: BatchScheduler(llm, **options))
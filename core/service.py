@@ -0,0 +1,306 @@
+"""JSON-over-HTTP pipeline service that keeps model and dataset resident.
+
+    python -m core.service --port 8600 --case pglib_opf_case14_ieee
+
+Endpoints:
+    GET  /health         liveness
+    GET  /status         resident models/datasets and cache counters
+    POST /load           {"model", "profile", "case"}: load (or reuse) resources
+    POST /query          {"query", "case", "model", "profile", ...}: final result
+    POST /query/stream   same body, progress events as newline-delimited JSON
+    POST /cancel         {"request_id", "keep_preview"}: stop the query sent with
+                         that id, or only its full pass, finishing on the preview
+"""
+import argparse
+import base64
+import json
+import os
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_MODEL = "deepseek-ai/deepseek-coder-6.7b-instruct"
+DEFAULT_CASE = "pglib_opf_case14_ieee"
+
+
+def _b64(image):
+    return base64.b64encode(image).decode() if isinstance(image, bytes) else None
+
+
+def _wire_result(result):
+    from core.plots import render_figures
+    from core.transport import encode_value
+
+    result = render_figures(dict(result))
+    wire = {k: encode_value(v) for k, v in result.items() if k not in ["plot", "plots"]}
+    for key in ("plot", "plots"):
+        if key in result:
+            value = result[key]
+            wire[key] = [_b64(v) for v in value] if isinstance(value, list) else _b64(value)
+    return wire
+
+
+def to_wire(event):
+    """JSON-safe copy of a pipeline event.
+
+    Small tensors become lists, large ones base64 ``.npy`` and figures
+    base64 PNG.
+    """
+    if "result" not in event:
+        return event
+    return {**event, "result": _wire_result(event["result"])}
+
+
+class PipelineService:
+    """Owns the shared resources and runs queries for any number of clients."""
+
+    def __init__(self, root="data"):
+        self.root = root
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._runs = {}  # request_id -> (cancel, keep_preview) events of a running query
+        self._datasets = {}  # registry entries this service holds a reference to
+        self._models = {}
+
+    def _key_lock(self, key):
+        # One lock per resource: loading a new model never blocks queries
+        # on resources that are already resident
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def load(self, model_id=DEFAULT_MODEL, profile=None, case_name=DEFAULT_CASE):
+        from langchain.chains import LLMChain
+        from config.prompts import code_template, summary_template
+        from core import registry
+        from core.grid import open_case
+        from core.model import load_model, model_key
+        from core.sandbox import shared_pool
+
+        def load_case():
+            return open_case(case_name, root=self.root)
+
+        # Each key is acquired once and held for the service's lifetime
+        with self._key_lock(("dataset", case_name)):
+            if case_name not in self._datasets:
+                self._datasets[case_name] = registry.datasets.acquire(
+                    case_name, load_case, size_fn=lambda v: registry.tensor_bytes(v[1])
+                )
+            dataset, grid = self._datasets[case_name]
+        shared_pool(case_name, root=self.root)  # workers start warming now, not on the first query
+        llm_key = model_key(model_id, profile)
+        with self._key_lock(("model", llm_key)):
+            if llm_key not in self._models:
+                self._models[llm_key] = registry.models.acquire(
+                    llm_key, lambda: load_model(model_id, profile), size_fn=registry.tensor_bytes
+                )
+            llm = self._models[llm_key]
+        return {
+            "dataset": dataset,
+            "grid": grid,
+            "case_name": case_name,
+            "code_chain": LLMChain(llm=llm, prompt=code_template),
+            "summary_chain": LLMChain(llm=llm, prompt=summary_template),
+        }
+
+    def stream(self, request):
+        """Validate ``request`` and load its resources, then return its event iterator.
+
+        Bad requests raise ``ValueError`` and load failures raise here,
+        before any event is produced.  The query can be stopped with
+        :meth:`cancel` under its ``request_id``; closing the iterator early
+        stops it too.
+        """
+        from core.executor import stream_pipeline
+        from core.query_cache import shared_cache
+        from core.result_cache import shared_result_cache
+        from core.sandbox import shared_pool
+
+        query = request.get("query")
+        if not isinstance(query, str) or not query.strip():
+            raise ValueError("'query' must be a non-empty string")
+        request_id = str(request.get("request_id") or uuid.uuid4().hex)
+        with self._lock:
+            if request_id in self._runs:
+                raise ValueError(f"request_id {request_id!r} is already running")
+        resources = self.load(
+            request.get("model", DEFAULT_MODEL),
+            request.get("profile"),
+            request.get("case", DEFAULT_CASE),
+        )
+        case_name = resources["case_name"]
+        use_sandbox = request.get("sandbox", True)
+        cancel_event, keep_preview = threading.Event(), threading.Event()
+        events = stream_pipeline(
+            query,
+            resources["code_chain"],
+            resources["summary_chain"],
+            resources["dataset"],
+            grid=resources["grid"],
+            query_cache=shared_cache(os.path.join(self.root, "query_cache.sqlite")),
+            case_name=case_name,
+            regenerate=request.get("regenerate", False),
+            result_cache=shared_result_cache(os.path.join(self.root, "result_cache")),
+            sandbox=shared_pool(case_name, root=self.root) if use_sandbox else None,
+            sharded=use_sandbox and request.get("sharded", False),
+            candidates=request.get("candidates", 1) if use_sandbox else 1,
+            summary_tokens=request.get("summary_tokens"),
+            preview_samples=request.get("preview_samples", 0),
+            preview_only=request.get("preview_only", False),
+            cancel_event=cancel_event,
+            keep_preview=keep_preview,
+        )
+        return self._run(request_id, cancel_event, keep_preview, events)
+
+    def _run(self, request_id, cancel_event, keep_preview, events):
+        with self._lock:
+            self._runs[request_id] = cancel_event, keep_preview
+        try:
+            for event in events:
+                yield to_wire(event)
+        finally:
+            with self._lock:
+                self._runs.pop(request_id, None)
+            cancel_event.set()  # stops background work if the client went away
+            events.close()
+
+    def cancel(self, request_id, keep_preview=False):
+        """Stop the running query sent as ``request_id``; False if there is none.
+
+        With ``keep_preview`` only its full pass stops and the query
+        finishes on its preview result.
+        """
+        with self._lock:
+            events = self._runs.get(request_id)
+        if events is None:
+            return False
+        events[1 if keep_preview else 0].set()
+        return True
+
+    def status(self):
+        from core import registry
+        from core.model import profile_stats
+        from core.plots import images
+        from core.query_cache import shared_cache
+        from core.result_cache import shared_result_cache
+        from core.sandbox import pools_snapshot
+
+        return {
+            "profiles": [
+                {"model": model_id, "profile": profile, **record}
+                for (model_id, profile), record in profile_stats.items()
+            ],
+            "models": registry.models.snapshot(),
+            "datasets": registry.datasets.snapshot(),
+            "query_cache": shared_cache(os.path.join(self.root, "query_cache.sqlite")).stats(),
+            "result_cache": shared_result_cache(os.path.join(self.root, "result_cache")).stats(),
+            "image_cache": images.stats(),
+            "sandbox": pools_snapshot(),
+        }
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _json(self, status, payload):
+            body = json.dumps(payload, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._json(200, {"ok": True})
+            elif self.path == "/status":
+                self._json(200, service.status())
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            try:
+                request = self._body()
+                if self.path == "/load":
+                    service.load(
+                        request.get("model", DEFAULT_MODEL),
+                        request.get("profile"),
+                        request.get("case", DEFAULT_CASE),
+                    )
+                    self._json(200, service.status())
+                elif self.path == "/cancel":
+                    self._json(200, {"cancelled": service.cancel(
+                        str(request["request_id"]), bool(request.get("keep_preview", False))
+                    )})
+                elif self.path == "/query":
+                    final = {}
+                    for event in service.stream(request):
+                        if event["type"] == "done":
+                            final = event
+                    self._json(200, final)
+                elif self.path == "/query/stream":
+                    self._stream(service.stream(request))
+                else:
+                    self._json(404, {"error": "not found"})
+            except (KeyError, ValueError) as e:
+                self._json(400, {"error": str(e)})
+            except Exception as e:
+                self._json(500, {"error": str(e)})
+
+        def _chunk(self, payload):
+            line = json.dumps(payload, default=str).encode() + b"\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.flush()
+
+        def _stream(self, events):
+            # Headers are out after this point: failures become an error
+            # event and the chunked body is always terminated
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for event in events:
+                    self._chunk(event)
+            except (BrokenPipeError, ConnectionResetError):
+                events.close()  # the client is gone: stop its query
+                return
+            except Exception as e:
+                self._chunk({"type": "error", "error": str(e)})
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--root", default="data")
+    parser.add_argument("--model", default=None, help="preload this model (default: OPF_PRELOAD_MODEL)")
+    parser.add_argument("--profile", default=None)
+    parser.add_argument("--case", default=None, help="preload this case (default: OPF_PRELOAD_CASE)")
+    args = parser.parse_args()
+
+    from config.startup import preload
+
+    if preload["enabled"]:
+        args.model = args.model or preload["model"]
+        args.profile = args.profile or preload["profile"]
+        args.case = args.case or preload["case"]
+
+    service = PipelineService(root=args.root)
+    if args.model or args.case:
+        service.load(args.model or DEFAULT_MODEL, args.profile, args.case or DEFAULT_CASE)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Serving on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
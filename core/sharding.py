@@ -0,0 +1,132 @@
+import ast
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+REDUCTIONS = {"sum", "mean", "min", "max", "concat", "histogram"}
+
+
+class NotShardSafe(Exception):
+    """The generated code cannot be split across dataset shards."""
+
+
+def parse_merge_spec(code):
+    """Return the literal ``result_merge`` dict declared by ``code``, if any."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+            isinstance(target, ast.Name) and target.id == "result_merge" for target in node.targets
+        ):
+            try:
+                spec = ast.literal_eval(node.value)
+            except ValueError:
+                return None
+            if isinstance(spec, dict) and all(op in REDUCTIONS for op in spec.values()):
+                return spec
+            return None
+    return None
+
+
+def shard_ranges(num_samples, num_shards):
+    num_shards = max(1, min(num_shards, num_samples))
+    step, extra = divmod(num_samples, num_shards)
+    ranges, start = [], 0
+    for i in range(num_shards):
+        end = start + step + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _as_tensor(value):
+    return value if isinstance(value, torch.Tensor) else torch.as_tensor(value)
+
+
+def _restore(merged, like):
+    if isinstance(like, torch.Tensor):
+        return merged
+    if isinstance(like, list):
+        return merged.tolist()
+    return merged.item() if merged.numel() == 1 else merged.tolist()
+
+
+def merge_values(op, values, weights):
+    first = values[0]
+    if op == "concat":
+        if isinstance(first, torch.Tensor):
+            return torch.cat([v if v.dim() else v.reshape(1) for v in values])
+        merged = []
+        for v in values:
+            merged.extend(v if isinstance(v, list) else [v])
+        return merged
+    if op == "histogram" and isinstance(first, dict):
+        # {"counts": ..., "bin_edges": ...}: bins must match across shards
+        if "bin_edges" in first:
+            edges = _as_tensor(first["bin_edges"])
+            for v in values[1:]:
+                other = _as_tensor(v.get("bin_edges", []))
+                if other.shape != edges.shape or not torch.equal(other.to(edges.dtype), edges):
+                    raise NotShardSafe("histogram bin_edges differ between shards")
+        merged = dict(first)
+        merged["counts"] = merge_values("sum", [v["counts"] for v in values], weights)
+        return merged
+
+    tensors = [_as_tensor(v).to(torch.float64) if op == "mean" else _as_tensor(v) for v in values]
+    if op in ("sum", "histogram"):
+        merged = torch.stack(tensors).sum(dim=0)
+    elif op == "mean":
+        w = torch.tensor(weights, dtype=torch.float64).view(-1, *[1] * tensors[0].dim())
+        merged = (torch.stack(tensors) * w).sum(dim=0) / w.sum()
+    elif op == "min":
+        merged = torch.stack(tensors).min(dim=0).values
+    else:
+        merged = torch.stack(tensors).max(dim=0).values
+    return _restore(merged, first)
+
+
+def merge_results(spec, shard_results, weights):
+    keys = set().union(*(r.keys() for r in shard_results))
+    if keys & {"plot", "plots"} and any(r.get("plot") or r.get("plots") for r in shard_results):
+        raise NotShardSafe("figures cannot be merged across shards")
+    keys -= {"plot", "plots"}
+    missing = keys - set(spec)
+    if missing:
+        raise NotShardSafe(f"no reduction declared for {sorted(missing)}")
+
+    merged = {}
+    for key in keys:
+        present = [(r[key], w) for r, w in zip(shard_results, weights) if key in r]
+        merged[key] = merge_values(spec[key], [v for v, _ in present], [w for _, w in present])
+    return merged
+
+
+def run_sharded(code, pool, num_samples, num_shards=None, stats=None, cancel_event=None):
+    """Run ``code`` once per dataset shard on ``pool`` and merge the results.
+
+    Raises :class:`NotShardSafe` when the code has no usable ``result_merge``
+    spec or produces something that cannot be merged; callers fall back to
+    a serial run.
+    """
+    spec = parse_merge_spec(code)
+    if spec is None:
+        raise NotShardSafe("code does not declare a result_merge spec")
+
+    ranges = shard_ranges(num_samples, num_shards or pool.size)
+    shard_stats = [{} for _ in ranges]
+    with ThreadPoolExecutor(max_workers=len(ranges)) as threads:
+        futures = [
+            threads.submit(pool.run, code, shard=shard, stats=shard_stat, cancel_event=cancel_event)
+            for shard, shard_stat in zip(ranges, shard_stats)
+        ]
+        shard_results = [f.result() for f in futures]
+    if stats is not None:
+        stats["samples_touched"] = sum(s.get("samples_touched", 0) for s in shard_stats)
+    try:
+        return merge_results(spec, shard_results, [end - start for start, end in ranges])
+    except (TypeError, ValueError, RuntimeError) as e:
+        # Values the declared reduction cannot combine (strings, ragged
+        # lists, dicts): the code itself is fine, so run it serially
+        raise NotShardSafe(f"shard results cannot be merged: {e}") from e
@@ -0,0 +1,161 @@
+"""Background loading for a fast cold start.
+
+Nothing heavy is imported at module level: torch, torch_geometric,
+transformers and langchain are pulled in by :func:`warm_imports` on a
+background thread, and a :class:`LoadJob` loads the dataset and the model
+concurrently through the shared registries.  Import, dataset and model
+times are recorded separately.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Process-wide timings in seconds, e.g. {"imports": 9.4}
+timings = {}
+
+_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="startup")
+_imports = None
+_imports_lock = threading.Lock()
+_preloaded = {}
+_preload_lock = threading.Lock()
+
+
+def _import_heavy():
+    started = time.perf_counter()
+    import torch
+
+    torch.classes.__path__ = []  # keeps Streamlit's module watcher away from torch.classes
+    import torch_geometric.datasets  # noqa: F401
+    import transformers  # noqa: F401
+    import langchain.chains  # noqa: F401
+    import core.executor  # noqa: F401
+    import core.model  # noqa: F401
+
+    timings["imports"] = round(time.perf_counter() - started, 2)
+
+
+def warm_imports():
+    """Start the heavy imports once per process; returns their future."""
+    global _imports
+    with _imports_lock:
+        if _imports is None:
+            _imports = _pool.submit(_import_heavy)
+        return _imports
+
+
+def cuda_hint():
+    """Whether CUDA is likely usable, without importing torch if it is not loaded yet."""
+    import sys
+
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        return torch.cuda.is_available()
+    return os.path.exists("/proc/driver/nvidia/version")
+
+
+class LoadJob:
+    """Dataset and model loaded concurrently, each through its registry.
+
+    The registry references the job acquires go to ``lease`` when one is
+    given (and are released with it), otherwise to the caller.
+    :meth:`progress` reports every stage as
+    ``{"state": "pending" | "running" | "done" | "error", "seconds", "error"}``.
+    """
+
+    def __init__(self, model_id, profile, case_name, root="data", lease=None):
+        self.lease = lease
+        self.model_id = model_id
+        self.profile = profile
+        self.case_name = case_name
+        self.root = root
+        self.stages = {
+            name: {"state": "pending", "seconds": None, "error": None}
+            for name in ("imports", "dataset", "model")
+        }
+        self._lock = threading.Lock()
+        imports = warm_imports()
+        self._imports = _pool.submit(self._stage, "imports", imports.result)
+        self.dataset = _pool.submit(self._stage, "dataset", self._load_dataset)
+        self.model = _pool.submit(self._stage, "model", self._load_model)
+
+    def _stage(self, name, work):
+        with self._lock:
+            self.stages[name]["state"] = "running"
+        started = time.perf_counter()
+        try:
+            value = work()
+        except Exception as e:
+            with self._lock:
+                self.stages[name].update(state="error", error=str(e))
+            raise
+        with self._lock:
+            self.stages[name].update(state="done", seconds=round(time.perf_counter() - started, 2))
+        return value
+
+    def _load_dataset(self):
+        self._imports.result()
+        from core import registry
+        from core.grid import open_case
+
+        value = registry.datasets.acquire(
+            self.case_name,
+            lambda: open_case(self.case_name, root=self.root),
+            size_fn=lambda v: registry.tensor_bytes(v[1]),
+        )
+        if self.lease is not None:
+            self.lease.hold(registry.datasets, self.case_name)
+        return self.case_name, value
+
+    def _load_model(self):
+        self._imports.result()
+        from core import registry
+        from core.model import load_model, model_key
+
+        key = model_key(self.model_id, self.profile)
+        value = registry.models.acquire(
+            key, lambda: load_model(self.model_id, self.profile), size_fn=registry.tensor_bytes
+        )
+        if self.lease is not None:
+            self.lease.hold(registry.models, key)
+        return key, value
+
+    def progress(self):
+        with self._lock:
+            return {name: dict(stage) for name, stage in self.stages.items()}
+
+    def done(self):
+        return self.dataset.done() and self.model.done()
+
+    def result(self):
+        """``((case_name, (dataset, grid)), (model_key, llm))``; raises a stage's error."""
+        return self.dataset.result(), self.model.result()
+
+
+def preload_on_boot(settings, root="data"):
+    """Start the configured preload once per process; returns its job or None.
+
+    The job's registry references are never released, so preloaded
+    entries stay resident for later sessions.
+    """
+    if not settings.get("enabled") or not (settings.get("model") or settings.get("case")):
+        return None
+    key = (settings.get("model"), settings.get("profile"), settings.get("case"), root)
+    with _preload_lock:
+        if key not in _preloaded:
+            _preloaded[key] = PreloadJob(settings, root)
+        return _preloaded[key]
+
+
+class PreloadJob(LoadJob):
+    """A :class:`LoadJob` where either half may be left out."""
+
+    def __init__(self, settings, root):
+        self._skip = {name for name in ("model", "case") if not settings.get(name)}
+        super().__init__(settings.get("model"), settings.get("profile"), settings.get("case"), root)
+
+    def _load_dataset(self):
+        return None if "case" in self._skip else super()._load_dataset()
+
+    def _load_model(self):
+        return None if "model" in self._skip else super()._load_model()
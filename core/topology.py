@@ -0,0 +1,137 @@
+import torch
+
+# Every edge type stored per sample by OPFDataset, forward and reverse links
+ALL_EDGE_TYPES = [
+    ("bus", "ac_line", "bus"),
+    ("bus", "transformer", "bus"),
+    ("generator", "generator_link", "bus"),
+    ("bus", "generator_link", "generator"),
+    ("load", "load_link", "bus"),
+    ("bus", "load_link", "load"),
+    ("shunt", "shunt_link", "bus"),
+    ("bus", "shunt_link", "shunt"),
+]
+
+
+def _incidence(bus_index, item_index, num_buses, num_items):
+    """Sparse CSR ``[num_buses, num_items]`` with a 1 where item sits on bus."""
+    values = torch.ones(bus_index.numel(), dtype=torch.float32)
+    coo = torch.sparse_coo_tensor(
+        torch.stack([bus_index.long(), item_index.long()]), values, (num_buses, num_items)
+    )
+    return coo.coalesce().to_sparse_csr()
+
+
+class Topology:
+    """Fixed grid topology of one pglib case, computed once.
+
+    - ``line_from`` / ``line_to``: AC line endpoint bus indices
+    - ``transformer_from`` / ``transformer_to``: transformer endpoint bus indices
+    - ``adjacency``: symmetric bus x bus CSR matrix (lines + transformers)
+    - ``bus_generator`` / ``bus_load`` / ``bus_shunt``: CSR incidence matrices
+      of shape ``[num_buses, num_items]``
+    """
+
+    def __init__(self, edge_index, num_buses, num_generators, num_loads, num_shunts):
+        empty = torch.zeros(2, 0, dtype=torch.long)
+        ac_line = edge_index.get("ac_line", empty).long()
+        transformer = edge_index.get("transformer", empty).long()
+        self.edge_index = edge_index
+        self.num_buses = num_buses
+        self.line_from, self.line_to = ac_line[0], ac_line[1]
+        self.transformer_from, self.transformer_to = transformer[0], transformer[1]
+
+        branches = torch.cat([ac_line, transformer], dim=1)
+        both = torch.cat([branches, branches.flip(0)], dim=1)
+        self.adjacency = torch.sparse_coo_tensor(
+            both, torch.ones(both.shape[1]), (num_buses, num_buses)
+        ).coalesce().to_sparse_csr()
+
+        # *_link edges run item -> bus
+        links = {
+            "generator_link": num_generators,
+            "load_link": num_loads,
+            "shunt_link": num_shunts,
+        }
+        for name, num_items in links.items():
+            link = edge_index.get(name, empty).long()
+            matrix = _incidence(link[1], link[0], num_buses, num_items)
+            setattr(self, "bus_" + name.split("_")[0], matrix)
+
+    @classmethod
+    def from_grid(cls, grid):
+        def count(name):
+            value = getattr(grid, name, None)
+            return value.shape[1] if value is not None else 0
+
+        return cls(
+            grid.edge_index,
+            count("bus_x"),
+            count("generator_x"),
+            count("load_x"),
+            count("shunt_x"),
+        )
+
+    def per_bus(self, values, incidence):
+        """Aggregate per-item ``values`` ``[S, num_items]`` to ``[S, num_buses]``.
+
+        e.g. ``topology.per_bus(grid.generator_y[:, :, 0], topology.bus_generator)``
+        """
+        matrix = incidence.to(values.dtype) if values.dtype != torch.float32 else incidence
+        return (matrix @ values.T.contiguous()).T
+
+    def __repr__(self):
+        return (
+            f"Topology(num_buses={self.num_buses}, ac_lines={self.line_from.numel()}, "
+            f"transformers={self.transformer_from.numel()})"
+        )
+
+
+class AttachTopology:
+    """Dataset transform putting the shared ``edge_index`` tensors on a sample."""
+
+    def __init__(self, edge_index, transform=None):
+        self.edge_index = edge_index
+        self.transform = transform
+
+    def __call__(self, data):
+        for edge_type, value in self.edge_index.items():
+            data[edge_type].edge_index = value
+        return self.transform(data) if self.transform is not None else data
+
+
+def share_topology(dataset):
+    """Drop per-sample ``edge_index`` copies from a collated ``InMemoryDataset``.
+
+    Only edge types whose connectivity is identical in every sample are
+    deduplicated; those are re-attached to each sample by reference through
+    the dataset's ``transform``.  Returns the edge types that were shared.
+    """
+    data = getattr(dataset, "_data", None)
+    slices = getattr(dataset, "slices", None)
+    if data is None or slices is None or getattr(dataset, "_indices", None) is not None:
+        return []
+
+    num_samples = len(dataset)
+    shared = {}
+    for edge_type in ALL_EDGE_TYPES:
+        if edge_type not in data.edge_types or "edge_index" not in data[edge_type]:
+            continue
+        bounds = slices[edge_type]["edge_index"]
+        sizes = bounds[1:] - bounds[:-1]
+        if not bool((sizes == sizes[0]).all()):
+            continue
+        collated = data[edge_type].edge_index
+        first = collated[:, :int(sizes[0])]
+        if not bool((collated.view(2, num_samples, -1) == first.unsqueeze(1)).all()):
+            continue
+        shared[edge_type] = first.clone()
+
+    if not shared:
+        return []
+    for edge_type in shared:
+        del data[edge_type].edge_index
+        del slices[edge_type]["edge_index"]
+    dataset._data_list = None  # drop samples separated before the change
+    dataset.transform = AttachTopology(shared, dataset.transform)
+    return list(shared)
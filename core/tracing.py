@@ -0,0 +1,126 @@
+import json
+import os
+import resource
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+def peak_rss_bytes():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Trace:
+    """Per-query list of timed spans, exportable as JSONL.
+
+    Spans are flat records with OpenTelemetry-style fields (trace/span ids,
+    unix-nano start and end, attributes) so they can be aggregated offline
+    or forwarded to a collector.
+    """
+
+    enabled = True
+
+    def __init__(self, query=None, **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.attributes = dict(attributes, query=query)
+        self.spans = []
+        self._started = time.perf_counter()
+        self._started_unix_ns = time.time_ns()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": uuid.uuid4().hex[:16],
+            "name": name,
+            "attributes": attributes,
+        }
+        start = time.perf_counter()
+        try:
+            yield record["attributes"]
+        finally:
+            end = time.perf_counter()
+            record["start_time_unix_nano"] = self._started_unix_ns + int((start - self._started) * 1e9)
+            record["end_time_unix_nano"] = self._started_unix_ns + int((end - self._started) * 1e9)
+            record["duration_ms"] = round((end - start) * 1000, 2)
+            record["attributes"]["peak_rss_bytes"] = peak_rss_bytes()
+            self.spans.append(record)
+
+    def totals(self):
+        """Milliseconds per span name, summed over repeats (e.g. retries)."""
+        totals = {}
+        for record in self.spans:
+            totals[record["name"]] = round(totals.get(record["name"], 0) + record["duration_ms"], 2)
+        return totals
+
+    def export(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        lines = [
+            json.dumps({**record, "resource": self.attributes}, default=str)
+            for record in self.spans
+        ]
+        with _export_lock, open(path, "a") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+class NullTrace:
+    """Disabled trace: spans cost one generator frame and record nothing."""
+
+    enabled = False
+    spans = []
+
+    @contextmanager
+    def span(self, name, **attributes):
+        yield {}
+
+    def totals(self):
+        return {}
+
+    def export(self, path):
+        pass
+
+
+NULL_TRACE = NullTrace()
+_export_lock = threading.Lock()
+
+
+class Cancelled(RuntimeError):
+    """The run was cancelled while generated code was reading the dataset."""
+
+
+class CountingDataset:
+    """Dataset proxy counting how many samples generated code materializes.
+
+    Once ``cancel_event`` is set, the next sample read raises
+    :class:`Cancelled`, which stops in-process code that loops over samples.
+    """
+
+    def __init__(self, dataset, counter=None, cancel_event=None):
+        self._dataset = dataset
+        self._counter = counter if counter is not None else [0]
+        self._cancel_event = cancel_event
+
+    @property
+    def samples_touched(self):
+        return self._counter[0]
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitem__(self, index):
+        if self._cancel_event is not None and self._cancel_event.is_set():
+            raise Cancelled("Execution cancelled")
+        item = self._dataset[index]
+        if isinstance(item, type(self._dataset)):
+            return CountingDataset(item, self._counter, self._cancel_event)  # slice / index select
+        self._counter[0] += 1
+        return item
+
+    def __iter__(self):
+        for i in range(len(self._dataset)):
+            yield self[i]
+
+    def __getattr__(self, name):
+        return getattr(self._dataset, name)
@@ -0,0 +1,156 @@
+"""Size-aware handling of ``result`` dictionaries.
+
+Small values travel as plain JSON.  Arrays above ``INLINE_ELEMENTS`` stay
+binary: NumPy ``.npz`` for download, base64 ``.npy`` on the HTTP wire, and
+a bounded statistical sketch wherever text is needed (summary prompt,
+JSON reports).  Torch is not imported here so thin clients can decode
+results without it.
+"""
+import base64
+import io
+import json
+import numbers
+
+import numpy as np
+
+# Arrays with more elements than this are never expanded into JSON lists
+INLINE_ELEMENTS = 256
+PLOT_KEYS = ("plot", "plots")
+
+
+def _is_tensor(value):
+    return type(value).__module__.startswith("torch") and hasattr(value, "detach")
+
+
+def as_array(value):
+    """``value`` as a NumPy array if it is array-like and numeric, else None."""
+    if _is_tensor(value):
+        value = value.detach().cpu()
+        if str(value.dtype) == "torch.bfloat16":  # no NumPy equivalent
+            value = value.float()
+        return value.numpy()
+    if isinstance(value, np.ndarray):
+        return value
+    if isinstance(value, (list, tuple)) and len(value) > INLINE_ELEMENTS:
+        try:
+            array = np.asarray(value)
+        except ValueError:  # ragged
+            return None
+        return array if array.dtype.kind in "biuf" else None
+    return None
+
+
+def is_large(value):
+    array = as_array(value)
+    return array is not None and array.size > INLINE_ELEMENTS
+
+
+def sketch(value, head=5):
+    """Shape, dtype, range, mean and the first ``head`` values of an array."""
+    array = as_array(value)
+    if array is None:
+        return value
+    info = {"shape": list(array.shape), "dtype": str(array.dtype)}
+    if array.size and array.dtype.kind in "biuf":
+        finite = array[np.isfinite(array)] if array.dtype.kind == "f" else array
+        if finite.size:
+            info.update(
+                min=float(finite.min()),
+                max=float(finite.max()),
+                mean=float(finite.mean()),
+                std=float(finite.std()),
+            )
+        if finite.size < array.size:
+            info["non_finite"] = int(array.size - finite.size)
+    if head:
+        info["head"] = array.reshape(-1)[:head].tolist()
+    return info
+
+
+def jsonable(value, head=5):
+    """JSON-safe copy of ``value``; large arrays become a :func:`sketch`."""
+    if isinstance(value, dict):
+        return {k: jsonable(v, head) for k, v in value.items()}
+    if is_large(value):
+        return {"sketch": sketch(value, head)}
+    if _is_tensor(value) or isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [jsonable(v, head) for v in value]
+    return value
+
+
+def _estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def summary_payload(result, max_tokens=1024, head=5, count_tokens=None):
+    """Compact JSON of ``result`` for the summary prompt, within ``max_tokens``.
+
+    Large arrays are sketched.  If the text is still over budget the head
+    samples are shortened, then trailing keys are dropped with a note.
+    """
+    count_tokens = count_tokens or _estimate_tokens
+    values = {k: v for k, v in result.items() if k not in PLOT_KEYS}
+    keys = list(values)
+    text = ""
+    for size in sorted({head, 2, 0}, reverse=True):
+        text = json.dumps(jsonable(values, size), default=str)
+        if count_tokens(text) <= max_tokens:
+            return text
+
+    while keys:
+        keys.pop()
+        kept = {k: values[k] for k in keys}
+        payload = jsonable(kept, 0)
+        payload["_omitted_keys"] = len(values) - len(keys)
+        text = json.dumps(payload, default=str)
+        if count_tokens(text) <= max_tokens:
+            return text
+    return text[: max_tokens * 4]
+
+
+def to_npz(result):
+    """All array values of ``result`` as a compressed ``.npz`` (nested keys joined by '/')."""
+    arrays = {}
+
+    def collect(prefix, value):
+        if isinstance(value, dict):
+            for k, v in value.items():
+                collect(f"{prefix}/{k}" if prefix else str(k), v)
+            return
+        array = as_array(value)
+        if array is None and isinstance(value, (list, tuple, numbers.Number)):
+            try:
+                array = np.asarray(value)
+            except ValueError:
+                array = None
+        if array is not None and array.dtype.kind in "biufc":
+            arrays[prefix] = array
+
+    collect("", {k: v for k, v in result.items() if k not in PLOT_KEYS})
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def encode_value(value):
+    """Wire form of a result value: large arrays as base64 ``.npy``."""
+    if isinstance(value, dict):
+        return {k: encode_value(v) for k, v in value.items()}
+    if is_large(value):
+        buffer = io.BytesIO()
+        np.save(buffer, as_array(value), allow_pickle=False)
+        return {"__ndarray__": base64.b64encode(buffer.getvalue()).decode("ascii")}
+    return jsonable(value)
+
+
+def decode_value(value):
+    """Inverse of :func:`encode_value`."""
+    if isinstance(value, dict):
+        if set(value) == {"__ndarray__"}:
+            return np.load(io.BytesIO(base64.b64decode(value["__ndarray__"])), allow_pickle=False)
+        return {k: decode_value(v) for k, v in value.items()}
+    return value
@@ -0,0 +1,45 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from core.query_cache import QueryCache, key_tokens, normalize_query
+
+CASE = "pglib_opf_case14_ieee"
+FINGERPRINT = "prompt-v1"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return QueryCache(str(tmp_path / "query_cache.sqlite"))
+
+
+def test_exact_match_ignores_case_and_punctuation(cache):
+    cache.put("Mean voltage of bus 3?", CASE, FINGERPRINT, "code_a")
+    assert cache.get("mean voltage of BUS 3", CASE, FINGERPRINT) == ("code_a", 1.0)
+    assert cache.stats()["hits"] == 1
+
+
+def test_entries_are_scoped_by_case_and_fingerprint(cache):
+    cache.put("mean voltage of bus 3", CASE, FINGERPRINT, "code_a")
+    assert cache.get("mean voltage of bus 3", "pglib_opf_case118_ieee", FINGERPRINT) is None
+    assert cache.get("mean voltage of bus 3", CASE, "prompt-v2") is None
+
+
+def test_fuzzy_match_needs_the_same_numbers(cache):
+    cache.threshold = 0.5
+    cache.put("plot the active power of generator 3", CASE, FINGERPRINT, "code_gen3")
+    assert cache.get("plot the active power of generator 5", CASE, FINGERPRINT) is None
+    code, score = cache.get("please plot the active power of generator 3", CASE, FINGERPRINT)
+    assert code == "code_gen3" and 0.5 <= score < 1.0
+
+
+def test_fuzzy_match_needs_the_same_entities_and_statistics(cache):
+    cache.threshold = 0.5
+    cache.put("maximum loading of lines", CASE, FINGERPRINT, "code_max")
+    assert cache.get("minimum loading of lines", CASE, FINGERPRINT) is None
+    assert cache.get("highest loading of lines", CASE, FINGERPRINT)[0] == "code_max"
+
+
+def test_key_tokens_canonicalizes_synonyms():
+    assert key_tokens(normalize_query("Average cost of generators 1-3")) == \
+        key_tokens(normalize_query("mean cost of generator 1 3"))
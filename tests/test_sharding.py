@@ -0,0 +1,94 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from core.sharding import (
+    NotShardSafe, merge_results, merge_values, parse_merge_spec, run_sharded, shard_ranges,
+)
+
+
+def test_shard_ranges_cover_every_sample():
+    assert shard_ranges(10, 3) == [(0, 4), (4, 7), (7, 10)]
+    assert shard_ranges(2, 8) == [(0, 1), (1, 2)]
+
+
+def test_parse_merge_spec():
+    code = "result = {}\nresult_merge = {'total': 'sum', 'peak': 'max'}\n"
+    assert parse_merge_spec(code) == {"total": "sum", "peak": "max"}
+    assert parse_merge_spec("result_merge = {'x': 'median'}") is None
+    assert parse_merge_spec("result = {}") is None
+
+
+def test_merge_values_reductions():
+    assert merge_values("sum", [1, 2, 3], [1, 1, 1]) == 6
+    assert merge_values("min", [4, 2, 3], [1, 1, 1]) == 2
+    assert merge_values("max", [[1, 5], [3, 2]], [1, 1]) == [3, 5]
+    assert merge_values("concat", [[1], [2, 3]], [1, 2]) == [1, 2, 3]
+    merged = merge_values("concat", [torch.tensor([1, 2]), torch.tensor(3)], [2, 1])
+    assert torch.equal(merged, torch.tensor([1, 2, 3]))
+
+
+def test_merge_values_mean_is_weighted_by_shard_size():
+    assert merge_values("mean", [1.0, 4.0], [3, 1]) == pytest.approx(1.75)
+    merged = merge_values("mean", [torch.tensor([0.0, 2.0]), torch.tensor([4.0, 2.0])], [1, 1])
+    assert torch.allclose(merged, torch.tensor([2.0, 2.0], dtype=torch.float64))
+
+
+def test_merge_values_histogram_sums_counts():
+    edges = [0.0, 0.5, 1.0]
+    merged = merge_values(
+        "histogram",
+        [{"counts": [1, 2], "bin_edges": edges}, {"counts": [3, 4], "bin_edges": edges}],
+        [1, 1],
+    )
+    assert merged == {"counts": [4, 6], "bin_edges": edges}
+
+
+def test_merge_values_histogram_rejects_mismatched_bins():
+    with pytest.raises(NotShardSafe):
+        merge_values(
+            "histogram",
+            [{"counts": [1, 2], "bin_edges": [0.0, 0.5, 1.0]},
+             {"counts": [3, 4], "bin_edges": [0.0, 0.4, 1.0]}],
+            [1, 1],
+        )
+
+
+def test_merge_results():
+    spec = {"total": "sum", "peak": "max"}
+    merged = merge_results(spec, [{"total": 1, "peak": 5, "plots": []}, {"total": 2, "peak": 7}], [1, 1])
+    assert merged == {"total": 3, "peak": 7}
+
+
+def test_merge_results_not_shard_safe():
+    with pytest.raises(NotShardSafe):
+        merge_results({"total": "sum"}, [{"total": 1, "other": 2}], [1])
+    with pytest.raises(NotShardSafe):
+        merge_results({"total": "sum"}, [{"total": 1, "plots": [object()]}], [1])
+
+
+class _FakePool:
+    size = 2
+
+    def __init__(self, results):
+        self.results = results
+
+    def run(self, code, shard=None, stats=None, cancel_event=None):
+        return self.results[shard[0]]
+
+
+@pytest.mark.parametrize("op, first, second", [
+    ("max", "a", "b"),
+    ("mean", [1.0, 2.0], [1.0, 2.0, 3.0]),
+    ("sum", {"x": 1}, {"x": 2}),
+])
+def test_run_sharded_unmergeable_values_are_not_shard_safe(op, first, second):
+    code = f"result_merge = {{'value': '{op}'}}"
+    pool = _FakePool({0: {"value": first}, 2: {"value": second}})
+    with pytest.raises(NotShardSafe):
+        run_sharded(code, pool, num_samples=4)
+
+
+def test_run_sharded_merges_shards():
+    pool = _FakePool({0: {"total": 1.0}, 2: {"total": 2.0}})
+    assert run_sharded("result_merge = {'total': 'sum'}", pool, num_samples=4) == {"total": 3.0}
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from core.transport import INLINE_ELEMENTS, decode_value, encode_value, summary_payload
+
+
+def test_summary_payload_keeps_small_values_and_drops_plots():
+    payload = json.loads(summary_payload({"total": 3.5, "names": ["a", "b"], "plots": [b"png"]}))
+    assert payload == {"total": 3.5, "names": ["a", "b"]}
+
+
+def test_summary_payload_sketches_large_arrays():
+    values = np.arange(INLINE_ELEMENTS * 4, dtype=np.float64)
+    payload = json.loads(summary_payload({"values": values}, head=3))
+    sketch = payload["values"]["sketch"]
+    assert sketch["shape"] == [values.size]
+    assert sketch["min"] == 0.0 and sketch["max"] == values.size - 1
+    assert sketch["head"] == [0.0, 1.0, 2.0]
+
+
+def test_summary_payload_stays_within_budget():
+    result = {f"key_{i}": "x" * 200 for i in range(20)}
+    text = summary_payload(result, max_tokens=100)
+    assert len(text) // 4 + 1 <= 100
+    assert json.loads(text)["_omitted_keys"] > 0
+
+
+def test_encode_decode_round_trip():
+    large = np.linspace(0, 1, INLINE_ELEMENTS + 1)
+    wire = encode_value({"large": large, "small": [1, 2]})
+    assert set(wire["large"]) == {"__ndarray__"}
+    decoded = decode_value(json.loads(json.dumps(wire)))
+    assert np.array_equal(decoded["large"], large)
+    assert decoded["small"] == [1, 2]